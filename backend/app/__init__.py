@@ -3,8 +3,8 @@ from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from app.models import db
+from app.setup import database_url
 from apscheduler.schedulers.background import BackgroundScheduler
-from sqlalchemy import text
 import os
 
 app = Flask(__name__, static_folder='static', template_folder='templates', static_url_path='')
@@ -12,22 +12,37 @@ app = Flask(__name__, static_folder='static', template_folder='templates', stati
 app_dir = os.path.abspath(os.path.dirname(__file__))
 parent_dir = os.path.dirname(app_dir)
 
-app.config["SQLALCHEMY_DATABASE_URI"] = (
-    f'sqlite:///{os.path.join(parent_dir, "users.db")}'
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url(
+    os.getenv("DATABASE_URL", f'sqlite:///{os.path.join(parent_dir, "users.db")}')
 )
+if not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    }
 app.config["SECRET_KEY"] = os.getenv(
     "FLASK_SECRET_KEY", "default_key_sample_a5%@saw^97A"
 )
 app.config["JWT_SECRET_KEY"] = os.getenv(
     "JWT_SECRET_KEY", "jwt_secret_key_sample_b8#@xzw^12B"
 )
+app.config["QUIZGEN_PROVIDER"] = os.getenv("QUIZGEN_PROVIDER", "instructor")
+app.config["QUIZGEN_MODEL"] = os.getenv("QUIZGEN_MODEL", "google/gemini-2.0-flash")
+app.config["QUIZGEN_OFFLINE_LATENCY"] = float(os.getenv("QUIZGEN_OFFLINE_LATENCY", "0"))
+app.config["QUIZGEN_OFFLINE_FAILURE_RATE"] = float(
+    os.getenv("QUIZGEN_OFFLINE_FAILURE_RATE", "0")
+)
+# The response cache is runtime data, so it lives in the instance folder rather
+# than next to the source.
+app.config["LLM_CACHE_PATH"] = os.getenv(
+    "LLM_CACHE_PATH", os.path.join(app.instance_path, "llm_cache.db")
+)
+app.config["SQL_REPEAT_LOG_THRESHOLD"] = int(os.getenv("SQL_REPEAT_LOG_THRESHOLD", "0"))
+app.config["SQL_METRICS_ENDPOINT"] = os.getenv("SQL_METRICS_ENDPOINT", "0") == "1"
 
 
-@app.before_request
-def enable_foreign_keys():
-    db.session.execute(text("PRAGMA foreign_keys = ON"))
-    db.session.commit()
-
 @app.route('/')
 def serve_react():
     return render_template('index.html')
@@ -44,10 +59,45 @@ from app.setup import setup_db
 
 setup_db(app, db)
 
+from app.sql_metrics import sql_metrics
+
+with app.app_context():
+    sql_metrics.init_app(app, db.engine)
+
+from app.providers import configure_provider
+
+configure_provider(
+    app.config["QUIZGEN_PROVIDER"],
+    app.config["QUIZGEN_MODEL"],
+    latency=app.config["QUIZGEN_OFFLINE_LATENCY"],
+    failure_rate=app.config["QUIZGEN_OFFLINE_FAILURE_RATE"],
+)
+
+from app.llm_cache import response_cache
+
+os.makedirs(os.path.dirname(app.config["LLM_CACHE_PATH"]) or ".", exist_ok=True)
+response_cache.configure(app.config["LLM_CACHE_PATH"])
+
 from app.auth_routes import auth_bp
 from app.teacher_routes import teacher_bp
 from app.student import student_bp
+from app.admin_routes import admin_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(teacher_bp)
 app.register_blueprint(student_bp)
+app.register_blueprint(admin_bp)
+
+from app.commands import register_commands
+
+register_commands(app)
+
+from app.jobs import resume_jobs
+from app.utils import resume_auto_submits
+
+resume_jobs()
+resume_auto_submits()
+
+from app.autosave import start_autosave
+
+start_autosave(scheduler)
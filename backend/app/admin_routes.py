@@ -0,0 +1,74 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required
+from app.identity import current_user
+from app.llm_cache import response_cache
+from app.llm_usage import usage_rollup, ROLLUP_COLUMNS
+from app.sql_metrics import sql_metrics
+from datetime import datetime
+from functools import wraps
+
+admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
+
+
+def admin_required(func):
+    @wraps(func)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        user = current_user()
+
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        if user.role != "admin":
+            return jsonify({"error": "Only admins are allowed to access this"}), 403
+
+        kwargs["user"] = user
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@admin_bp.route("/quizgen_cache", methods=["GET"])
+@admin_required
+def quizgen_cache_stats(user):
+    return jsonify(response_cache.stats()), 200
+
+
+@admin_bp.route("/quizgen_cache/clear", methods=["POST"])
+@admin_required
+def clear_quizgen_cache(user):
+    response_cache.clear()
+    return jsonify({"message": "Quiz generation cache cleared."}), 200
+
+
+@admin_bp.route("/llm_usage", methods=["GET"])
+@admin_required
+def llm_usage(user):
+    """
+    Rollups of LLMCallLog. Query parameters: group_by (course, teacher, model,
+    response_model or question_types; default course), and since/until as ISO
+    timestamps.
+    """
+    group_by = request.args.get("group_by", "course")
+    if group_by not in ROLLUP_COLUMNS:
+        return (
+            jsonify({"error": f"group_by must be one of {list(ROLLUP_COLUMNS)}"}),
+            400,
+        )
+
+    try:
+        since = request.args.get("since", None)
+        until = request.args.get("until", None)
+        since = datetime.fromisoformat(since) if since else None
+        until = datetime.fromisoformat(until) if until else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid timestamp: {str(e)}"}), 400
+
+    return jsonify(usage_rollup(group_by, since, until)), 200
+
+
+@admin_bp.route("/sql_metrics", methods=["GET"])
+@admin_required
+def sql_metrics_stats(user):
+    """SQL statements and time per endpoint, with each one's slowest statement."""
+    return jsonify(sql_metrics.stats()), 200
@@ -1,7 +1,8 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import bcrypt, db
 from app.models import User
+from app.identity import access_token_for
 import re
 from datetime import timedelta
 
@@ -114,11 +115,7 @@ def auth_login():
     if not bcrypt.check_password_hash(user.password, password):
         return jsonify({"error": "Invalid Credentials"}), 401
 
-    access_token = create_access_token(
-        identity=email_id,
-        additional_claims={"role": user.role, "name": user.name},
-        expires_delta=timedelta(days=2),
-    )
+    access_token = access_token_for(user, expires_delta=timedelta(days=2))
 
     return (
         jsonify(
@@ -0,0 +1,142 @@
+"""
+Answers saved while a test is in progress. Each save is graded and kept in memory,
+where later edits of the same answer replace it (counting the change), and the
+buffer is written to the database in batches: every AUTOSAVE_FLUSH_SECONDS, when it
+holds AUTOSAVE_MAX_PENDING answers, and for an attempt before it is submitted. So
+the writes of a class are spread across the exam window rather than all landing
+at the deadline, and a crash loses seconds of answers instead of the whole sheet.
+
+The buffer is per process. An answer saved in another worker reaches the database
+by that worker's next flush; submit_attempt still takes the whole sheet, which
+covers it.
+"""
+
+from app.constants import *
+from app import db, app
+from app.grading import upsert_answers
+from app.models import StudentTestAttempt
+from sqlalchemy import select
+import atexit, json, threading, traceback
+
+
+class AnswerBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while writing, so a flush for one attempt waits for rows of that
+        # attempt already taken by another flush.
+        self.flush_lock = threading.Lock()
+        self.pending = {}  # attempt_id -> {question_id: row for upsert_answers}
+        self.size = 0
+
+    def add(self, row):
+        """Buffer a graded answer row. Returns the number of answers pending."""
+        with self.lock:
+            answers = self.pending.setdefault(row["attempt_id"], {})
+            previous = answers.get(row["question_id"])
+
+            if previous is None:
+                answers[row["question_id"]] = row
+                self.size += 1
+            else:
+                self.merge(previous, row)
+                answers[row["question_id"]] = row
+
+            return self.size
+
+    @staticmethod
+    def merge(earlier, row):
+        """Fold the edits of ``earlier`` into ``row``, which follows them."""
+        row["answer_change_count"] += earlier["answer_change_count"] + (
+            earlier["selected_answer"] != row["first_answer"]
+        )
+        row["answer_changed"] = row["answer_change_count"] > 0
+        row["first_answer"] = earlier["first_answer"]
+        if row["time_spent_seconds"] is None:
+            row["time_spent_seconds"] = earlier["time_spent_seconds"]
+
+    def answers(self, attempt_id):
+        """{question_id: selected answer} pending for the attempt."""
+        with self.lock:
+            return {
+                question_id: json.loads(row["selected_answer"])
+                for question_id, row in self.pending.get(attempt_id, {}).items()
+            }
+
+    def take(self, attempt_ids=None):
+        with self.lock:
+            if attempt_ids is None:
+                taken, self.pending = self.pending, {}
+            else:
+                taken = {
+                    attempt_id: self.pending.pop(attempt_id)
+                    for attempt_id in attempt_ids
+                    if attempt_id in self.pending
+                }
+            rows = [row for answers in taken.values() for row in answers.values()]
+            self.size -= len(rows)
+            return rows
+
+    def restore(self, rows):
+        """Put back rows that could not be written, before any edit made since."""
+        with self.lock:
+            for row in rows:
+                answers = self.pending.setdefault(row["attempt_id"], {})
+                later = answers.get(row["question_id"])
+                if later is None:
+                    answers[row["question_id"]] = row
+                    self.size += 1
+                else:
+                    self.merge(row, later)
+
+    def flush(self, attempt_ids=None):
+        """
+        Write the pending answers (of ``attempt_ids``, or all) and commit. Answers to
+        attempts no longer in progress are dropped. Returns the number written.
+        """
+        with self.flush_lock:
+            rows = self.take(attempt_ids)
+            if not rows:
+                return 0
+
+            try:
+                open_attempts = set(
+                    db.session.scalars(
+                        select(StudentTestAttempt.attempt_id).where(
+                            StudentTestAttempt.attempt_id.in_(
+                                {row["attempt_id"] for row in rows}
+                            ),
+                            StudentTestAttempt.status == "in_progress",
+                        )
+                    )
+                )
+                writes = [row for row in rows if row["attempt_id"] in open_attempts]
+                upsert_answers(db.session.connection(), writes)
+                db.session.commit()
+                return len(writes)
+
+            except Exception:
+                db.session.rollback()
+                self.restore(rows)
+                raise
+
+
+answer_buffer = AnswerBuffer()
+
+
+def flush_answers():
+    with app.app_context():
+        try:
+            answer_buffer.flush()
+        except Exception:
+            print(traceback.format_exc())
+
+
+def start_autosave(scheduler):
+    scheduler.add_job(
+        flush_answers,
+        "interval",
+        seconds=AUTOSAVE_FLUSH_SECONDS,
+        id="flush_answers",
+        replace_existing=True,
+    )
+    atexit.register(flush_answers)
@@ -0,0 +1,155 @@
+from app.constants import *
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging, random, threading, time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Calls run here so a slow one can be abandoned or hedged; the caller only waits.
+call_executor = ThreadPoolExecutor(
+    max_workers=QUIZGEN_CALL_WORKERS, thread_name_prefix="llm"
+)
+
+# A slot per worker, held from submit until the call returns, abandoned calls
+# included. Calls never queue behind the pool, so each starts as it is submitted.
+call_slots = threading.BoundedSemaphore(QUIZGEN_CALL_WORKERS)
+
+
+class CallTimeout(Exception):
+    pass
+
+
+class Call:
+    """``fn()`` on call_executor, in a call slot the caller has acquired."""
+
+    def __init__(self, fn):
+        self.started = threading.Event()
+        self.started_at = None
+        try:
+            self.future = call_executor.submit(self.run, fn)
+        except BaseException:
+            call_slots.release()
+            raise
+
+    def run(self, fn):
+        self.started_at = time.monotonic()
+        self.started.set()
+        try:
+            return fn()
+        finally:
+            call_slots.release()
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies, kept per kind of call."""
+
+    def __init__(self, window=QUIZGEN_LATENCY_WINDOW):
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+        self.lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self.lock:
+            self.samples[key].append(seconds)
+
+    def percentile(self, key, q):
+        """The q-th percentile latency, or None until enough calls were seen."""
+        with self.lock:
+            samples = list(self.samples[key])
+        if len(samples) < QUIZGEN_HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(samples, q))
+
+
+latency_tracker = LatencyTracker()
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(
+        0, min(QUIZGEN_BACKOFF_CAP, QUIZGEN_BACKOFF_BASE * 2**attempt)
+    )
+
+
+def hedged_call(fn, key, timeout, stats=None):
+    """
+    Run ``fn()`` with a deadline of ``timeout`` seconds. If it is still running
+    once the QUIZGEN_HEDGE_PERCENTILE latency for ``key`` has passed, a duplicate
+    request is sent and whichever succeeds first wins.
+
+    The deadline counts from when ``fn`` starts running, after waiting for a call
+    slot. No duplicate is sent while every slot is taken. Calls that lose the race
+    or miss the deadline cannot be interrupted; they run to completion in the
+    background, holding their slot, and their result is dropped.
+    """
+    call_slots.acquire()
+    call = Call(fn)
+    call.started.wait()
+
+    start = call.started_at
+    deadline = start + timeout
+    hedge_after = latency_tracker.percentile(key, QUIZGEN_HEDGE_PERCENTILE)
+
+    running = {call.future}
+    hedged = hedge_after is None
+    error = None
+
+    while running:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+
+        wait_for = deadline - now
+        if not hedged:
+            wait_for = min(wait_for, max(0.0, start + hedge_after - now))
+
+        done, running = wait(running, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                latency_tracker.record(key, time.monotonic() - start)
+                return future.result()
+            error = error or future.exception()
+
+        if not hedged and time.monotonic() >= start + hedge_after:
+            hedged = True
+            if call_slots.acquire(blocking=False):
+                running.add(Call(fn).future)
+                if stats is not None:
+                    stats["hedged"] = True
+
+    if error is not None and not running:
+        raise error
+    raise CallTimeout(f"No response within {timeout} seconds")
+
+
+def call_with_policy(fn, key, timeout=None, retries=None, stats=None):
+    """
+    Call ``fn()`` under the quiz generation call policy: each attempt is a
+    hedged call with a timeout, and failed attempts are retried up to
+    ``retries`` times with exponential backoff. The last error is re-raised.
+
+    If a ``stats`` dict is given, "attempts" and "hedged" are recorded in it.
+    """
+    timeout = timeout or QUIZGEN_CALL_TIMEOUT
+    retries = QUIZGEN_CALL_RETRIES if retries is None else retries
+
+    for attempt in range(retries + 1):
+        if stats is not None:
+            stats["attempts"] = attempt + 1
+        try:
+            return hedged_call(fn, key, timeout, stats)
+        except Exception as e:
+            if attempt == retries:
+                raise
+            delay = backoff_delay(attempt)
+            # Not an error yet: only the last attempt's failure reaches the caller.
+            logger.warning(
+                "%s call failed (attempt %d of %d), retrying in %.1fs: %r",
+                key,
+                attempt + 1,
+                retries + 1,
+                delay,
+                e,
+            )
+            time.sleep(delay)
@@ -0,0 +1,166 @@
+from app.models import (
+    db,
+    Jobs,
+    SchemaVersion,
+    Questions,
+    QuestionTag,
+    StudentQuestionAttempt,
+    StudentTestAttempt,
+    Student_Courses_Map,
+    Teacher_Courses_Map,
+    Tests,
+)
+from sqlalchemy import create_engine, func, inspect, select, text
+from app.migrations import backfill_question_tags
+import click, os
+
+# The lookups behind the student and teacher endpoints. Each must be answered
+# from an index; check-query-plans fails if any of them scans its table.
+HOT_QUERIES = {
+    "attempt by test, student and status": select(StudentTestAttempt).filter_by(
+        test_id=1, student_id=1, status="in_progress"
+    ),
+    "attempts of a student": select(StudentTestAttempt).filter_by(student_id=1),
+    "attempts of a test": select(StudentTestAttempt).filter_by(test_id=1),
+    "enrollment of a student in a course": select(Student_Courses_Map).filter_by(
+        student_id=1, course_id="CS101"
+    ),
+    "enrollments of a course": select(Student_Courses_Map).filter_by(
+        course_id="CS101"
+    ),
+    "courses of a teacher": select(Teacher_Courses_Map).filter_by(teacher_id=1),
+    "offering of a course": select(Teacher_Courses_Map).filter_by(
+        course_id="CS101", offered_at="Fall_2025"
+    ),
+    "questions of a test": select(Questions).filter_by(test_id=1),
+    "tags of a question": select(QuestionTag).filter_by(question_id=1),
+    "questions with a tag": select(QuestionTag).filter_by(tag_id=1),
+    "tests of a course": select(Tests).filter_by(course_id="CS101"),
+    "answers of an attempt": select(StudentQuestionAttempt).filter_by(attempt_id=1),
+    "answers to a question": select(StudentQuestionAttempt).filter_by(question_id=1),
+    "jobs by status": select(Jobs).filter_by(status="queued"),
+}
+
+
+def table_scans(connection, statement):
+    """The query plan lines of ``statement`` that read a whole table."""
+    sql = str(
+        statement.compile(
+            dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+        )
+    )
+
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+        plan = [row[-1] for row in rows]
+        # "SEARCH t USING INDEX ..." is an index lookup; "SCAN t" reads every row.
+        return [line for line in plan if line.startswith("SCAN")]
+
+    # The planner prefers sequential scans on small tables, so discourage them to
+    # see whether an index could be used at all.
+    connection.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = [row[0] for row in connection.execute(text(f"EXPLAIN {sql}"))]
+    return [line for line in plan if "Seq Scan" in line]
+
+
+def copy_table(source, target, table, batch_size):
+    """Copy the rows of ``table``, restricted to the columns the source has."""
+    source_columns = {c["name"] for c in inspect(source).get_columns(table.name)}
+    columns = [c for c in table.columns if c.name in source_columns]
+
+    copied = 0
+    result = source.execute(select(*columns))
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        target.execute(table.insert(), [dict(row._mapping) for row in rows])
+        copied += len(rows)
+
+    return copied
+
+
+def reset_sequences(target, table):
+    """Move a PostgreSQL id sequence past the copied ids."""
+    column = table.autoincrement_column
+    if column is None:
+        return
+
+    preparer = target.dialect.identifier_preparer
+    quoted_table = preparer.quote(table.name)
+    target.execute(
+        text(
+            f"SELECT setval(pg_get_serial_sequence(:table, :column), "
+            f"COALESCE(MAX({preparer.quote(column.name)}), 0) + 1, false) "
+            f"FROM {quoted_table}"
+        ),
+        {"table": quoted_table, "column": column.name},
+    )
+
+
+def register_commands(app):
+    @app.cli.command("copy-sqlite")
+    @click.argument("sqlite_path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--batch-size", default=1000, show_default=True)
+    def copy_sqlite(sqlite_path, batch_size):
+        """Copy an existing SQLite database into the empty DATABASE_URL database."""
+        source_engine = create_engine(f"sqlite:///{os.path.abspath(sqlite_path)}")
+
+        if db.engine.dialect.name == "sqlite" and os.path.samefile(
+            db.engine.url.database, sqlite_path
+        ):
+            raise click.ClickException("DATABASE_URL points at the source database.")
+
+        db.create_all()
+
+        # The target's schema_version rows are its own: the app migrated it on
+        # startup, and the source may be at an older version.
+        tables = [
+            table
+            for table in db.metadata.sorted_tables
+            if table is not SchemaVersion.__table__
+        ]
+
+        with source_engine.connect() as source, db.engine.begin() as target:
+            source_tables = set(inspect(source).get_table_names())
+
+            for table in tables:
+                if target.execute(select(func.count()).select_from(table)).scalar():
+                    raise click.ClickException(
+                        f"Table {table.name} is not empty in the target database."
+                    )
+
+            # Parents before children, so foreign keys hold throughout.
+            for table in tables:
+                if table.name not in source_tables:
+                    click.echo(f"{table.name}: not in source, skipped")
+                    continue
+
+                copied = copy_table(source, target, table, batch_size)
+                if target.dialect.name == "postgresql":
+                    reset_sequences(target, table)
+                click.echo(f"{table.name}: {copied} rows")
+
+            # The target's migrations ran before there was data to backfill.
+            backfill_question_tags(target)
+
+        source_engine.dispose()
+
+    @app.cli.command("check-query-plans")
+    def check_query_plans():
+        """Fail if a query in HOT_QUERIES is planned as a full table scan."""
+        failed = []
+
+        with db.engine.begin() as connection:
+            for name, statement in HOT_QUERIES.items():
+                scans = table_scans(connection, statement)
+                click.echo(f"{'SCAN' if scans else 'ok':>4}  {name}")
+                for line in scans:
+                    click.echo(f"      {line.strip()}")
+                if scans:
+                    failed.append(name)
+
+        if failed:
+            raise click.ClickException(
+                f"{len(failed)} hot queries scan a whole table: {', '.join(failed)}"
+            )
@@ -19,3 +19,68 @@ COURSE_LEVELS = [
     "Undergraduate",
     "Postgraduate",
 ]
+
+QUIZGEN_MAX_WORKERS = 8
+QUIZGEN_DEDUP_ROUNDS = 3
+QUIZGEN_STRATEGY = "batched"  # One of batched, per_question
+QUIZGEN_BATCH_SIZE = 10
+QUIZGEN_BATCH_ROUNDS = 2
+QUIZGEN_CALL_TIMEOUT = 60  # Seconds per model call attempt
+QUIZGEN_CALL_RETRIES = 3
+QUIZGEN_BACKOFF_BASE = 1.0
+QUIZGEN_BACKOFF_CAP = 20.0
+QUIZGEN_HEDGE_PERCENTILE = 95
+QUIZGEN_HEDGE_MIN_SAMPLES = 20
+QUIZGEN_LATENCY_WINDOW = 200
+QUIZGEN_CALL_WORKERS = 32
+
+LLM_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+LLM_CACHE_MAX_ENTRIES = 20000
+LLM_CACHE_EVICT_EVERY = 100  # Writes between eviction passes
+LLM_USAGE_FLUSH_SIZE = 50
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # Readers no longer block the writer
+    "synchronous": "NORMAL",  # No fsync per commit; still corruption-safe in WAL
+    "busy_timeout": 10000,  # Milliseconds to wait for the write lock
+    "cache_size": -64000,  # Negative means KiB, so 64 MB of page cache
+    "mmap_size": 268435456,
+    "foreign_keys": "ON",
+}
+
+# Also how long a user change made in another worker can take to apply here
+USER_CACHE_TTL_SECONDS = 5
+USER_CACHE_MAX_ENTRIES = 10000
+
+JOB_WORKERS = 2
+JOB_STALE_SECONDS = 600
+JOB_STREAM_POLL_SECONDS = 0.5
+JOB_STREAM_KEEPALIVE_SECONDS = 15
+
+QUESTION_BANK_MAX_PER_COURSE = 500
+QUESTION_BANK_MAX_AGE_DAYS = 365
+
+DEDUP_SHINGLE_SIZE = 5
+DEDUP_NUM_PERMUTATIONS = 64
+DEDUP_BANDS = 8
+DEDUP_THRESHOLD = 0.85
+
+NAT_TOLERANCE = 0.01
+ANSWER_KEY_CACHE_MAX_ENTRIES = 1000
+
+AUTOSAVE_FLUSH_SECONDS = 5
+AUTOSAVE_MAX_PENDING = 2000
+
+# Attempts finished by the student or, at the deadline, by auto_submit_attempts
+SUBMITTED_STATUSES = ["submitted", "auto_submitted"]
+# Answers buffered by any worker are written before the deadline sweep
+AUTO_SUBMIT_GRACE_SECONDS = 2 * AUTOSAVE_FLUSH_SECONDS
+# Tests that closed longer ago are left alone by the startup sweep: their open
+# attempts were abandoned before auto-submission existed, not missed by a restart.
+AUTO_SUBMIT_RESUME_WINDOW_SECONDS = 24 * 60 * 60
+
+# Test start times are entered, and stored, as wall-clock time in this zone
+TEST_TIMEZONE = "Asia/Kolkata"
+
+REGRADE_BATCH_SIZE = 1000
+SCORE_TOLERANCE = 1e-9
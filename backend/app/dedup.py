@@ -0,0 +1,111 @@
+from app.constants import *
+import hashlib, re, threading
+import numpy as np
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+_rng = np.random.RandomState(1306)
+PERMUTATION_A = _rng.randint(1, MERSENNE_PRIME, size=DEDUP_NUM_PERMUTATIONS, dtype=np.int64)
+PERMUTATION_B = _rng.randint(0, MERSENNE_PRIME, size=DEDUP_NUM_PERMUTATIONS, dtype=np.int64)
+
+
+def normalize_question_text(question_text):
+    return " ".join(re.findall(r"\w+", question_text.lower()))
+
+
+def shingles(question_text, size=DEDUP_SHINGLE_SIZE):
+    text = normalize_question_text(question_text)
+    if len(text) <= size:
+        return {text}
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+def minhash_signature(question_text):
+    hashes = np.array(
+        [
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+            % MERSENNE_PRIME
+            for s in shingles(question_text)
+        ],
+        dtype=np.int64,
+    )
+    # (a * x + b) mod p for every permutation and shingle; a, x < 2**31 so no overflow.
+    permuted = (np.outer(PERMUTATION_A, hashes) + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+class NearDuplicateIndex:
+    """
+    Locality-sensitive index over question texts. Texts are shingled into character
+    n-grams and MinHashed; the signature is split into DEDUP_BANDS bands and two
+    texts become candidates when any band matches. Candidates whose estimated
+    Jaccard similarity reaches DEDUP_THRESHOLD count as near-duplicates.
+    """
+
+    def __init__(self, texts=()):
+        self.rows = DEDUP_NUM_PERMUTATIONS // DEDUP_BANDS
+        self.buckets = [{} for _ in range(DEDUP_BANDS)]
+        self.signatures = []
+        self.texts = []
+        self.exact = {}
+        self.lock = threading.Lock()
+
+        for text in texts:
+            self.add(text)
+
+    def _band_keys(self, signature):
+        return [
+            signature[b * self.rows : (b + 1) * self.rows].tobytes()
+            for b in range(DEDUP_BANDS)
+        ]
+
+    def add(self, question_text):
+        signature = minhash_signature(question_text)
+        with self.lock:
+            self._insert(question_text, signature)
+
+    def find(self, question_text):
+        """The indexed text that ``question_text`` nearly duplicates, or None."""
+        signature = minhash_signature(question_text)
+        with self.lock:
+            return self._lookup(question_text, signature)
+
+    def add_if_new(self, question_text):
+        """Index ``question_text`` unless it collides; returns the colliding text, if any."""
+        signature = minhash_signature(question_text)
+
+        # One critical section, so two threads adding near-duplicates of each other
+        # cannot both miss the other and both be indexed.
+        with self.lock:
+            match = self._lookup(question_text, signature)
+            if match is None:
+                self._insert(question_text, signature)
+            return match
+
+    def _insert(self, question_text, signature):
+        key = len(self.texts)
+        self.texts.append(question_text)
+        self.signatures.append(signature)
+        self.exact.setdefault(normalize_question_text(question_text), key)
+
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(band_key, []).append(key)
+
+    def _lookup(self, question_text, signature):
+        key = self.exact.get(normalize_question_text(question_text))
+        if key is not None:
+            return self.texts[key]
+
+        candidates = set()
+        for bucket, band_key in zip(self.buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band_key, ()))
+
+        for key in candidates:
+            similarity = np.mean(self.signatures[key] == signature)
+            if similarity >= DEDUP_THRESHOLD:
+                return self.texts[key]
+
+        return None
+
+    def __len__(self):
+        return len(self.texts)
@@ -0,0 +1,582 @@
+"""
+Batch grading. A test's answer key is compiled once into arrays: a bitmask of the
+correct options for MCQ/MSQ questions and a float for NAT ones. Answer sheets,
+one or many, are encoded the same way and graded with a few NumPy comparisons.
+Compiled keys are kept in answer_keys, per test and questions_version, so neither
+grading nor showing results parses the stored JSON again.
+
+StudentQuestionAttempt.check_answer is the reference: the results must match it
+for every answer (python -m tests.checkGrading compares the two on random sheets).
+Keys that do not fit the arrays (an MCQ answer that is not an option id, an MSQ
+answer with repeats or foreign ids, more than 64 options) are graded with the
+reference's own comparisons.
+"""
+
+from app.constants import *
+from app.models import (
+    db,
+    Questions,
+    StudentTestAttempt,
+    StudentQuestionAttempt,
+    ScoreAudit,
+    dialect_insert,
+)
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import and_, bindparam, case, func, insert, select, update
+import json, math, threading
+import numpy as np
+
+MCQ, MSQ, NAT, EXACT, NEVER = range(5)
+MAX_OPTIONS = 64
+
+
+def exact_match(question_type, correct_answer, selected):
+    """check_answer's comparison, for keys that are not compiled to arrays."""
+    try:
+        if question_type == "mcq":
+            return selected == correct_answer
+        if question_type == "msq":
+            return (
+                isinstance(selected, list)
+                and isinstance(correct_answer, list)
+                and sorted(selected) == sorted(correct_answer)
+            )
+    except Exception:
+        pass
+    return False
+
+
+class AnswerKey:
+    """The answers and marks of a test's questions, as arrays indexed by position."""
+
+    __slots__ = (
+        "question_ids",
+        "positions",
+        "kinds",
+        "question_types",
+        "marks",
+        "masks",
+        "counts",
+        "numbers",
+        "option_bits",
+        "exact_answers",
+        "options",
+        "correct_answers",
+    )
+
+    def __init__(self, rows):
+        """``rows``: (question_id, question_type, options, correct_answer, marks),
+        with options and correct_answer as stored (JSON strings)."""
+        size = len(rows)
+        self.question_ids = np.empty(size, dtype=np.int64)
+        self.positions = {}
+        self.kinds = np.full(size, NEVER, dtype=np.int8)
+        self.question_types = []
+        self.marks = np.zeros(size, dtype=np.float64)
+        self.masks = np.zeros(size, dtype=np.uint64)
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.numbers = np.full(size, np.nan, dtype=np.float64)
+        self.option_bits = [None] * size
+        self.exact_answers = {}
+        # Parsed, for showing with results. Shared: not to be modified.
+        self.options = [None] * size
+        self.correct_answers = [None] * size
+
+        for position, row in enumerate(rows):
+            question_id, question_type, options, correct_answer, marks = row
+            question_type = (question_type or "").lower()
+            self.question_ids[position] = question_id
+            self.positions[question_id] = position
+            self.question_types.append(question_type)
+            self.marks[position] = float(marks)
+            self._compile(position, question_type, options, correct_answer)
+
+    @classmethod
+    def load(cls, test_id):
+        rows = db.session.execute(
+            select(
+                Questions.question_id,
+                Questions.question_type,
+                Questions.options,
+                Questions.correct_answer,
+                Questions.marks,
+            )
+            .where(Questions.test_id == test_id)
+            .order_by(Questions.question_id)
+        ).all()
+        return cls(rows)
+
+    def _compile(self, position, question_type, options, correct_answer):
+        try:
+            options = json.loads(options) if options else None
+        except Exception:
+            options = None
+        self.options[position] = options
+
+        try:
+            answer = self.correct_answers[position] = json.loads(correct_answer)
+        except Exception:
+            return  # NEVER, as check_answer fails to parse it
+
+        if question_type == "nat":
+            try:
+                self.numbers[position] = float(answer)
+                self.kinds[position] = NAT
+            except (ValueError, TypeError, OverflowError):
+                pass
+            return
+
+        if question_type not in ("mcq", "msq"):
+            return
+
+        try:
+            option_ids = [option["id"] for option in options or []]
+        except Exception:
+            option_ids = []
+        bits = {
+            option_id: 1 << n
+            for n, option_id in enumerate(option_ids[:MAX_OPTIONS])
+            if isinstance(option_id, str)
+        }
+
+        if question_type == "mcq" and isinstance(answer, str) and answer in bits:
+            self.kinds[position] = MCQ
+            self.masks[position] = bits[answer]
+            self.counts[position] = 1
+        elif (
+            question_type == "msq"
+            and isinstance(answer, list)
+            and all(isinstance(a, str) and a in bits for a in answer)
+            and len(set(answer)) == len(answer)
+        ):
+            self.kinds[position] = MSQ
+            self.masks[position] = sum(bits[a] for a in answer)
+            self.counts[position] = len(answer)
+        else:
+            self.kinds[position] = EXACT
+            self.exact_answers[position] = answer
+            return
+
+        self.option_bits[position] = bits
+
+    def __len__(self):
+        return len(self.question_ids)
+
+
+class AnswerKeyCache:
+    """
+    Compiled answer keys by test, least recently used out beyond
+    ANSWER_KEY_CACHE_MAX_ENTRIES. A key is reused while its test's questions_version
+    is unchanged; every write to the questions replaces it, so keys cached by other
+    processes go stale without being told.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # test_id -> (questions_version, AnswerKey)
+
+    def get(self, test):
+        """The key of ``test`` (a Tests row) at its current questions_version."""
+        with self.lock:
+            entry = self.entries.get(test.test_id)
+            if entry is not None and entry[0] == test.questions_version:
+                self.entries.move_to_end(test.test_id)
+                return entry[1]
+
+        # Loaded outside the lock; two requests may both load a new version.
+        key = AnswerKey.load(test.test_id)
+        self.put(test.test_id, test.questions_version, key)
+        return key
+
+    def put(self, test_id, version, key):
+        with self.lock:
+            self.entries[test_id] = (version, key)
+            self.entries.move_to_end(test_id)
+            while len(self.entries) > ANSWER_KEY_CACHE_MAX_ENTRIES:
+                self.entries.popitem(last=False)
+
+
+answer_keys = AnswerKeyCache()
+
+
+class GradedSheets:
+    """Grades of answer sheets against a key: arrays of shape (sheets, questions)."""
+
+    __slots__ = ("key", "answered", "selected", "is_correct", "marks")
+
+    def __init__(self, key, answered, selected, is_correct, marks):
+        self.key = key
+        self.answered = answered
+        self.selected = selected
+        self.is_correct = is_correct
+        self.marks = marks
+
+    def scores(self):
+        return self.marks.sum(axis=1)
+
+    def answers(self, row):
+        """(question_id, selected, is_correct, marks) of the answers on a sheet."""
+        for position in np.flatnonzero(self.answered[row]):
+            yield (
+                int(self.key.question_ids[position]),
+                self.selected[row][position],
+                bool(self.is_correct[row, position]),
+                float(self.marks[row, position]),
+            )
+
+
+def grade_sheets(key, sheets):
+    """
+    Grade answer sheets, each a {question_id: selected answer} dict as a student
+    submits it. Answers to questions not in the key are ignored.
+    """
+    shape = (len(sheets), len(key))
+    answered = np.zeros(shape, dtype=bool)
+    masks = np.zeros(shape, dtype=np.uint64)
+    counts = np.full(shape, -1, dtype=np.int64)
+    numbers = np.full(shape, np.nan, dtype=np.float64)
+    exact = np.zeros(shape, dtype=bool)
+    selected = [{} for _ in sheets]
+
+    for row, sheet in enumerate(sheets):
+        for question_id, answer in sheet.items():
+            position = key.positions.get(question_id)
+            if position is None:
+                continue
+
+            answered[row, position] = True
+            selected[row][position] = answer
+            kind = key.kinds[position]
+
+            if kind == MCQ:
+                bit = isinstance(answer, str) and key.option_bits[position].get(answer)
+                if bit:
+                    masks[row, position] = bit
+                    counts[row, position] = 1
+
+            elif kind == MSQ:
+                if isinstance(answer, list) and all(isinstance(a, str) for a in answer):
+                    option_bits = key.option_bits[position]
+                    if all(a in option_bits for a in answer):
+                        mask = 0
+                        for a in answer:
+                            mask |= option_bits[a]
+                        masks[row, position] = mask
+                        counts[row, position] = len(answer)
+
+            elif kind == NAT:
+                if answer is not None:
+                    try:
+                        numbers[row, position] = float(answer)
+                    except (ValueError, TypeError, OverflowError):
+                        pass
+
+            elif kind == EXACT:
+                exact[row, position] = exact_match(
+                    key.question_types[position], key.exact_answers[position], answer
+                )
+
+    kinds = key.kinds[np.newaxis, :]
+    with np.errstate(invalid="ignore"):
+        is_correct = answered & (
+            (
+                ((kinds == MCQ) | (kinds == MSQ))
+                & (masks == key.masks)
+                & (counts == key.counts)
+            )
+            | ((kinds == NAT) & (np.abs(numbers - key.numbers) < NAT_TOLERANCE))
+            | exact
+        )
+    marks = np.where(is_correct, key.marks, 0.0)
+
+    return GradedSheets(key, answered, selected, is_correct, marks)
+
+
+def answer_rows(graded, attempt_ids, time_spent=None):
+    """
+    StudentQuestionAttempt rows for the answers of each sheet, for upsert_answers.
+    ``time_spent``, if given, holds {question_id: seconds} per sheet.
+    """
+    now = datetime.utcnow()
+    rows = []
+    for row, attempt_id in enumerate(attempt_ids):
+        for question_id, answer, is_correct, marks in graded.answers(row):
+            selected_answer = json.dumps(answer)
+            rows.append(
+                {
+                    "attempt_id": attempt_id,
+                    "question_id": question_id,
+                    "selected_answer": selected_answer,
+                    "is_correct": is_correct,
+                    "marks_obtained": marks,
+                    "answered_at": now,
+                    "time_spent_seconds": (
+                        time_spent[row].get(question_id) if time_spent else None
+                    ),
+                    "answer_changed": False,
+                    "answer_change_count": 0,
+                    "first_answer": selected_answer,
+                }
+            )
+    return rows
+
+
+def upsert_answers(connection, rows, changed_only=False):
+    """
+    Insert or update answers, from answer_rows or app.autosave, with one statement.
+    A row may stand for several edits of an answer: answer_change_count holds the
+    changes among them and first_answer the first. An edit that differs from the
+    answer saved before counts as a change, as it always has in submit_attempt. A row
+    older than the saved answer is skipped, so out of order writes do not undo edits.
+    With ``changed_only`` a row that repeats the saved answer is skipped as well.
+    """
+    if not rows:
+        return
+
+    table = StudentQuestionAttempt.__table__
+    statement = dialect_insert(connection)(table)
+    excluded = statement.excluded
+    change_count = (
+        table.c.answer_change_count
+        + excluded.answer_change_count
+        + case(
+            (table.c.selected_answer.is_distinct_from(bindparam("first_answer")), 1),
+            else_=0,
+        )
+    )
+    conditions = [table.c.answered_at <= excluded.answered_at]
+    if changed_only:
+        conditions.append(
+            table.c.selected_answer.is_distinct_from(excluded.selected_answer)
+        )
+    statement = statement.on_conflict_do_update(
+        index_elements=["attempt_id", "question_id"],
+        set_={
+            "selected_answer": excluded.selected_answer,
+            "is_correct": excluded.is_correct,
+            "marks_obtained": excluded.marks_obtained,
+            "answered_at": excluded.answered_at,
+            "time_spent_seconds": func.coalesce(
+                excluded.time_spent_seconds, table.c.time_spent_seconds
+            ),
+            "answer_changed": change_count > 0,
+            "answer_change_count": change_count,
+        },
+        where=and_(*conditions),
+    )
+    connection.execute(statement, rows)
+
+
+def save_answers(graded, attempt_ids):
+    """
+    Write the graded answers of each sheet to its attempt. Answers the attempt has
+    saved already, through autosave say, are left as they are.
+    """
+    upsert_answers(
+        db.session.connection(), answer_rows(graded, attempt_ids), changed_only=True
+    )
+
+
+def load_sheets(attempt_ids, *conditions):
+    """
+    The saved answers of ``attempt_ids``, as sheets for grade_sheets in the same
+    order, with their current grades: {(attempt_id, question_id): (is_correct,
+    marks)}. ``conditions`` on StudentTestAttempt select the answers to read.
+    """
+    rows = {attempt_id: row for row, attempt_id in enumerate(attempt_ids)}
+    sheets = [{} for _ in attempt_ids]
+    grades = {}
+
+    answers = db.session.execute(
+        select(
+            StudentQuestionAttempt.attempt_id,
+            StudentQuestionAttempt.question_id,
+            StudentQuestionAttempt.selected_answer,
+            StudentQuestionAttempt.is_correct,
+            StudentQuestionAttempt.marks_obtained,
+        )
+        .join(StudentTestAttempt)
+        .where(*conditions)
+    )
+    for attempt_id, question_id, selected_answer, is_correct, marks in answers:
+        if attempt_id not in rows:
+            continue
+        selected = json.loads(selected_answer) if selected_answer else None
+        sheets[rows[attempt_id]][question_id] = selected
+        grades[attempt_id, question_id] = (is_correct, marks)
+
+    return sheets, grades
+
+
+def update_answer_grades(graded, attempt_ids, grades):
+    """
+    Rewrite the answers that ``graded`` grades differently from ``grades``, with one
+    executemany. Returns {attempt_id: number of answers rewritten}.
+    """
+    changes = [
+        {
+            "b_attempt_id": attempt_id,
+            "b_question_id": question_id,
+            "is_correct": is_correct,
+            "marks_obtained": marks,
+        }
+        for row, attempt_id in enumerate(attempt_ids)
+        for question_id, _, is_correct, marks in graded.answers(row)
+        if grades[attempt_id, question_id] != (is_correct, marks)
+    ]
+    if changes:
+        table = StudentQuestionAttempt.__table__
+        db.session.connection().execute(
+            update(table).where(
+                table.c.attempt_id == bindparam("b_attempt_id"),
+                table.c.question_id == bindparam("b_question_id"),
+            ),
+            changes,
+        )
+
+    counts = {}
+    for change in changes:
+        counts[change["b_attempt_id"]] = counts.get(change["b_attempt_id"], 0) + 1
+    return counts
+
+
+def score_fields(test, score):
+    """An attempt's score columns, as calculate_score sets them."""
+    return {
+        "total_score": score,
+        "percentage": (
+            round((score / test.total_marks) * 100, 2) if test.total_marks else None
+        ),
+        "passed": score >= test.passing_marks if test.passing_marks else None,
+    }
+
+
+def auto_submit_attempts(test, submitted_at):
+    """
+    Grade every attempt at ``test`` still in progress from its saved answers, in one
+    pass over all of them, and mark it auto_submitted at ``submitted_at``. Runs the
+    same few statements for any number of attempts; does not commit. Returns the
+    number of attempts submitted.
+    """
+    in_progress = (
+        StudentTestAttempt.test_id == test.test_id,
+        StudentTestAttempt.status == "in_progress",
+    )
+    attempts = db.session.execute(
+        select(StudentTestAttempt.attempt_id, StudentTestAttempt.started_at)
+        .where(*in_progress)
+        .order_by(StudentTestAttempt.attempt_id)
+    ).all()
+    if not attempts:
+        return 0
+
+    # No attempt can have taken longer than the test ran.
+    max_seconds = int(test.duration_minutes) * 60 if test.duration_minutes else math.inf
+
+    attempt_ids = [attempt_id for attempt_id, _ in attempts]
+    sheets, grades = load_sheets(attempt_ids, *in_progress)
+    graded = grade_sheets(answer_keys.get(test), sheets)
+
+    # Answers were graded when saved; only those graded differently are rewritten.
+    update_answer_grades(graded, attempt_ids, grades)
+
+    submitted = [
+        dict(
+            score_fields(test, score),
+            b_attempt_id=attempt_id,
+            status="auto_submitted",
+            submitted_at=submitted_at,
+            time_taken_seconds=min(
+                max(int((submitted_at - started_at).total_seconds()), 0),
+                max_seconds,
+            ),
+        )
+        for (attempt_id, started_at), score in zip(attempts, graded.scores().tolist())
+    ]
+
+    table = StudentTestAttempt.__table__
+    result = db.session.connection().execute(
+        update(table).where(
+            table.c.attempt_id == bindparam("b_attempt_id"),
+            table.c.status == "in_progress",
+        ),
+        submitted,
+    )
+    return result.rowcount
+
+
+def regrade_attempts(test, job_id=None, after_attempt_id=0, limit=REGRADE_BATCH_SIZE):
+    """
+    Regrade the next ``limit`` finished attempts at ``test`` (by attempt_id, after
+    ``after_attempt_id``) against its current answer key, as one batch. Answers graded
+    differently are rewritten; attempts whose score changes get the new score and a
+    ScoreAudit row for ``job_id``. Does not commit. Returns (last attempt_id or None
+    when there were none left, attempts regraded, scores changed).
+    """
+    finished = (
+        StudentTestAttempt.test_id == test.test_id,
+        StudentTestAttempt.status.in_(SUBMITTED_STATUSES),
+        StudentTestAttempt.attempt_id > after_attempt_id,
+    )
+    attempts = db.session.execute(
+        select(
+            StudentTestAttempt.attempt_id,
+            StudentTestAttempt.total_score,
+            StudentTestAttempt.percentage,
+            StudentTestAttempt.passed,
+        )
+        .where(*finished)
+        .order_by(StudentTestAttempt.attempt_id)
+        .limit(limit)
+    ).all()
+    if not attempts:
+        return None, 0, 0
+
+    attempt_ids = [attempt.attempt_id for attempt in attempts]
+    sheets, grades = load_sheets(
+        attempt_ids, *finished, StudentTestAttempt.attempt_id <= attempt_ids[-1]
+    )
+    graded = grade_sheets(answer_keys.get(test), sheets)
+    changed_answers = update_answer_grades(graded, attempt_ids, grades)
+
+    now = datetime.utcnow()
+    scores = []
+    audits = []
+    for attempt, score in zip(attempts, graded.scores().tolist()):
+        new = score_fields(test, score)
+        # Sums in a different order may differ in the last bits.
+        if (
+            abs(score - (attempt.total_score or 0)) < SCORE_TOLERANCE
+            and new["percentage"] == attempt.percentage
+            and new["passed"] == attempt.passed
+        ):
+            continue
+
+        scores.append(dict(new, b_attempt_id=attempt.attempt_id))
+        audits.append(
+            {
+                "job_id": job_id,
+                "test_id": test.test_id,
+                "attempt_id": attempt.attempt_id,
+                "old_score": attempt.total_score,
+                "new_score": score,
+                "old_percentage": attempt.percentage,
+                "new_percentage": new["percentage"],
+                "old_passed": attempt.passed,
+                "new_passed": new["passed"],
+                "changed_answers": changed_answers.get(attempt.attempt_id, 0),
+                "created_at": now,
+            }
+        )
+
+    if scores:
+        table = StudentTestAttempt.__table__
+        connection = db.session.connection()
+        connection.execute(
+            update(table).where(table.c.attempt_id == bindparam("b_attempt_id")),
+            scores,
+        )
+        connection.execute(insert(ScoreAudit), audits)
+
+    return attempt_ids[-1], len(attempts), len(scores)
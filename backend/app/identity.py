@@ -0,0 +1,146 @@
+from app.constants import *
+from app.models import db, User
+from collections import OrderedDict, namedtuple
+from datetime import timedelta, timezone
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity
+from sqlalchemy import event, select
+import threading, time
+
+# What the routes need to know about the caller. Not an ORM object: it comes from
+# the token's claims or the cache, without a query.
+CurrentUser = namedtuple("CurrentUser", ["id", "email", "name", "role"])
+
+
+class UserCache:
+    """
+    Recently seen users, bounded to USER_CACHE_MAX_ENTRIES each (least recently
+    used out first), with entries expiring after USER_CACHE_TTL_SECONDS:
+
+    - by email, for tokens that do not carry the uid claim;
+    - the time each user id last changed (User.updated_at), or None once the
+      user is gone. Claims in tokens issued before that time are not trusted.
+
+    The cache is per process. A change made here drops the user's entries at once;
+    one made by another worker is seen once the entries expire, so it can take up
+    to USER_CACHE_TTL_SECONDS to apply here.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # email -> (CurrentUser, expires_at)
+        self.changed_at = OrderedDict()  # user id -> (time of change, expires_at)
+
+    @staticmethod
+    def _get(entries, key):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+
+        if entry[1] < time.time():
+            del entries[key]
+            return None
+
+        entries.move_to_end(key)
+        return entry
+
+    @staticmethod
+    def _put(entries, key, value):
+        entries[key] = (value, time.time() + USER_CACHE_TTL_SECONDS)
+        entries.move_to_end(key)
+        while len(entries) > USER_CACHE_MAX_ENTRIES:
+            entries.popitem(last=False)
+
+    def get(self, email):
+        with self.lock:
+            entry = self._get(self.entries, email)
+            return entry[0] if entry else None
+
+    def put(self, user):
+        with self.lock:
+            self._put(self.entries, user.email, user)
+
+    def last_change(self, user_id):
+        """
+        (True, time of the user's last change or None if deleted) while cached,
+        else (False, None).
+        """
+        with self.lock:
+            entry = self._get(self.changed_at, user_id)
+            return (True, entry[0]) if entry else (False, None)
+
+    def record_change(self, user_id, changed_at):
+        with self.lock:
+            self._put(self.changed_at, user_id, changed_at)
+
+    def invalidate(self, user_id, email):
+        with self.lock:
+            self.entries.pop(email, None)
+            # Until the change is committed and can be read back, treat it as now.
+            self._put(self.changed_at, user_id, time.time())
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_user(mapper, connection, target):
+    user_cache.invalidate(target.id, target.email)
+
+
+def last_change(user_id):
+    """Unix time the user last changed (0 if never), or None if the user is gone."""
+    cached, changed_at = user_cache.last_change(user_id)
+    if cached:
+        return changed_at
+
+    row = db.session.execute(
+        select(User.updated_at).where(User.id == user_id)
+    ).one_or_none()
+    if row is None:
+        changed_at = None
+    elif row.updated_at is None:
+        changed_at = 0
+    else:
+        changed_at = row.updated_at.replace(tzinfo=timezone.utc).timestamp()
+
+    user_cache.record_change(user_id, changed_at)
+    return changed_at
+
+
+def access_token_for(user, expires_delta=timedelta(days=2)):
+    return create_access_token(
+        identity=user.email,
+        additional_claims={"uid": user.id, "role": user.role, "name": user.name},
+        expires_delta=expires_delta,
+    )
+
+
+def current_user():
+    """
+    The caller of a jwt_required route, or None if their account is gone. Signed
+    claims are trusted unless the user changed after the token was issued, which
+    is checked against User.updated_at at most every USER_CACHE_TTL_SECONDS; older
+    tokens without a uid claim are looked up through user_cache.
+    """
+    email = get_jwt_identity()
+    claims = get_jwt()
+
+    if "uid" in claims:
+        changed_at = last_change(claims["uid"])
+        if changed_at is None:
+            return None
+        if changed_at < claims["iat"]:
+            return CurrentUser(claims["uid"], email, claims.get("name"), claims["role"])
+
+    user = user_cache.get(email)
+    if user is not None:
+        return user
+
+    row = User.query.filter_by(email=email).first()
+    if row is None:
+        return None
+
+    user = CurrentUser(row.id, row.email, row.name, row.role)
+    user_cache.put(user)
+    return user
@@ -0,0 +1,291 @@
+from app.constants import *
+from app import db, app
+from app.models import Jobs, Tests, Courses, Questions, StudentTestAttempt
+from app.grading import regrade_attempts
+from app.quizgen import generate_quiz
+from app.question_bank import CourseQuestionBank
+from app.question_ingest import insert_questions, DUPLICATE_QUESTION_ERROR
+from app.dedup import NearDuplicateIndex
+from app.utils import distribute_marks
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, update
+import json, traceback
+
+executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+# Jobs that generate questions into their test
+QUESTION_JOB_KINDS = ["create_quiz", "add_questions"]
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def enqueue_job(kind, created_by, test_id, total_items, params):
+    """Persist a new job and hand it to the worker pool. Returns the job."""
+    job = Jobs(
+        kind=kind,
+        created_by=created_by,
+        test_id=test_id,
+        status="queued",
+        total_items=total_items,
+        params=params,
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    executor.submit(run_job, job.job_id)
+    return job
+
+
+def cancel_job(job):
+    """
+    Cancel a queued or running job. As in claim_job, the UPDATE is guarded by the
+    status it expects, so a worker claiming the job at the same moment either finds
+    it cancelled or has already moved it to running, and cleans up after itself.
+    """
+    finished_at = datetime.utcnow()
+    for status in ["queued", "running"]:
+        result = db.session.execute(
+            update(Jobs)
+            .where(Jobs.job_id == job.job_id, Jobs.status == status)
+            .values(status="cancelled", finished_at=finished_at)
+        )
+        if result.rowcount == 1:
+            break
+    else:
+        db.session.rollback()
+        raise ValueError(f"Job in {job.status} state cannot be cancelled.")
+
+    # A running job notices the cancellation at its next progress report and
+    # cleans up after itself; a queued one never starts, so clean up here.
+    if status == "queued":
+        undo_job(job)
+
+    db.session.commit()
+
+
+def claim_job(job_id):
+    """Atomically move a queued job to running, so only one worker picks it up."""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Jobs)
+        .where(Jobs.job_id == job_id, Jobs.status == "queued")
+        .values(status="running", started_at=now, heartbeat_at=now)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def is_cancelled(job_id):
+    status = db.session.execute(
+        select(Jobs.status).where(Jobs.job_id == job_id)
+    ).scalar_one_or_none()
+    return status in (None, "cancelled")
+
+
+def retry_job(job):
+    """Re-queue a failed job; it only generates the items it has not completed."""
+    if job.status != "failed" or job.test_id is None:
+        raise ValueError(f"Job in {job.status} state cannot be retried.")
+
+    job.status = "queued"
+    job.error = None
+    job.finished_at = None
+    db.session.commit()
+
+    executor.submit(run_job, job.job_id)
+
+
+def run_job(job_id):
+    with app.app_context():
+        if not claim_job(job_id):
+            return
+
+        job = db.session.get(Jobs, job_id)
+
+        try:
+            JOB_HANDLERS[job.kind](job)
+
+            if is_cancelled(job_id):
+                raise JobCancelled()
+
+            job.status = "completed"
+
+        except JobCancelled:
+            db.session.rollback()
+            undo_job(job)
+            job.status = "cancelled"
+
+        except Exception as e:
+            print(traceback.format_exc())
+            db.session.rollback()
+            job.status = "failed"
+            job.error = str(e)
+
+        # Questions are committed as they are generated, so whatever the outcome
+        # the test is left consistent with the questions it actually has.
+        if job.kind in QUESTION_JOB_KINDS:
+            finalize_test(job)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def undo_job(job):
+    # A quiz whose creation was cancelled is removed so that the title can be reused.
+    if job.kind == "create_quiz" and job.test_id is not None:
+        test_obj = db.session.get(Tests, job.test_id)
+        job.test_id = None
+        if test_obj:
+            db.session.delete(test_obj)
+
+
+def finalize_test(job):
+    test_obj = db.session.get(Tests, job.test_id) if job.test_id is not None else None
+    if not test_obj:
+        return
+
+    question_objs = Questions.query.filter_by(test_id=test_obj.test_id).all()
+    distribute_marks(question_objs, test_obj.total_marks)
+    test_obj.total_questions = len(question_objs)
+
+
+def question_callback(job, test_obj):
+    """Persist each accepted question right away, so a failure later on keeps it."""
+
+    def on_question(item):
+        if is_cancelled(job.job_id):
+            raise JobCancelled()
+
+        # Marks are assigned by finalize_test once the test's questions are known.
+        _, errors = insert_questions(
+            test_obj.test_id, [dict(item, options=item.get("options") or [])], marks=0
+        )
+        if errors and errors[0]["error"] == DUPLICATE_QUESTION_ERROR:
+            # Another job added the same question meanwhile; the test ends up one
+            # question short instead of failing with the rest of the batch.
+            print(f"Skipped question already in test {test_obj.test_id}")
+            return
+        if errors:
+            raise ValueError(errors[0]["error"])
+
+        job.completed_items += 1
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+    return on_question
+
+
+def run_generate_questions(job):
+    """Generate the job's remaining questions into its test."""
+    params = json.loads(job.params)
+    test_obj = db.session.get(Tests, job.test_id)
+    course_obj = Courses.query.filter_by(course_id=test_obj.course_id).first()
+
+    num_questions = job.total_items - job.completed_items
+    if num_questions <= 0:
+        return
+
+    existing_texts = [
+        q.question_text
+        for q in Questions.query.filter_by(test_id=test_obj.test_id).all()
+    ]
+
+    question_bank = None
+    if params.get("use_question_bank", True):
+        question_bank = CourseQuestionBank(
+            course_obj.course_id,
+            course_obj.course_level,
+            exclude_texts=existing_texts,
+            tags=params.get("tags"),
+        )
+
+    generate_quiz(
+        course_obj.course_name,
+        course_obj.course_level,
+        course_obj.course_objectives,
+        test_obj.title,
+        test_obj.description,
+        test_obj.difficulty_level,
+        num_questions,
+        test_obj.total_marks,
+        on_question=question_callback(job, test_obj),
+        question_bank=question_bank,
+        dedup_index=NearDuplicateIndex(existing_texts),
+        use_cache=not params.get("fresh", False),
+        usage_context={
+            "course_id": test_obj.course_id,
+            "teacher_id": job.created_by,
+            "job_id": job.job_id,
+        },
+    )
+
+
+def run_regrade(job):
+    """
+    Regrade the finished attempts of the job's test against its current questions,
+    REGRADE_BATCH_SIZE attempts per transaction. Batches already committed stay
+    regraded if the job is cancelled or fails; running it again only changes what
+    is still stale, so a retry or resume starts over.
+    """
+    test_obj = db.session.get(Tests, job.test_id) if job.test_id is not None else None
+    if not test_obj:
+        raise ValueError("Test not found")
+
+    job.total_items = db.session.execute(
+        select(func.count()).where(
+            StudentTestAttempt.test_id == test_obj.test_id,
+            StudentTestAttempt.status.in_(SUBMITTED_STATUSES),
+        )
+    ).scalar_one()
+    job.completed_items = 0
+    job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+
+    last_attempt_id = 0
+    while True:
+        if is_cancelled(job.job_id):
+            raise JobCancelled()
+
+        last_attempt_id, regraded, _ = regrade_attempts(
+            test_obj, job.job_id, last_attempt_id
+        )
+        if last_attempt_id is None:
+            return
+
+        job.completed_items += regraded
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+
+
+JOB_HANDLERS = {
+    "create_quiz": run_generate_questions,
+    "add_questions": run_generate_questions,
+    "regrade": run_regrade,
+}
+
+
+def resume_jobs():
+    """
+    Re-submit jobs left over from a previous process: queued jobs, and running
+    jobs whose heartbeat is older than JOB_STALE_SECONDS.
+    """
+    with app.app_context():
+        stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+
+        db.session.execute(
+            update(Jobs)
+            .where(Jobs.status == "running", Jobs.heartbeat_at < stale_before)
+            .values(status="queued")
+        )
+        db.session.commit()
+
+        job_ids = (
+            db.session.execute(select(Jobs.job_id).where(Jobs.status == "queued"))
+            .scalars()
+            .all()
+        )
+
+        for job_id in job_ids:
+            executor.submit(run_job, job_id)
@@ -0,0 +1,170 @@
+from app.constants import *
+from collections import Counter
+import hashlib, json, sqlite3, threading, time
+
+
+class ResponseCache:
+    """
+    Persistent cache of structured-output responses in its own SQLite file, keyed
+    by a hash of everything that determines the response: model, messages,
+    response schema and the call's ordinal within a generation run.
+
+    Entries expire after LLM_CACHE_TTL_SECONDS, and the least recently used ones
+    beyond LLM_CACHE_MAX_ENTRIES are evicted every LLM_CACHE_EVICT_EVERY writes.
+    Hit/miss counters are per process.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.connection = None
+
+    def configure(self, path):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+            self.path = path
+            self.connection = None
+
+    def _connect(self):
+        # One connection shared by all threads; every use holds self.lock.
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response_model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed_at)"
+            )
+            self.connection.commit()
+        return self.connection
+
+    def get(self, key, response_model):
+        """The cached response as a ``response_model`` instance, or None."""
+        with self.lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at >= ?",
+                (key, time.time() - LLM_CACHE_TTL_SECONDS),
+            ).fetchone()
+
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+
+            connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            connection.commit()
+            self.counters["hits"] += 1
+
+        return response_model.model_validate_json(row[0])
+
+    def put(self, key, response):
+        now = time.time()
+        with self.lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, type(response).__name__, response.model_dump_json(), now, now),
+            )
+            connection.commit()
+            self.counters["writes"] += 1
+
+            if self.counters["writes"] % LLM_CACHE_EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        connection = self._connect()
+        evicted = connection.execute(
+            "DELETE FROM responses WHERE created_at < ?",
+            (time.time() - LLM_CACHE_TTL_SECONDS,),
+        ).rowcount
+        evicted += connection.execute(
+            """
+            DELETE FROM responses WHERE key NOT IN (
+                SELECT key FROM responses ORDER BY accessed_at DESC LIMIT ?
+            )
+            """,
+            (LLM_CACHE_MAX_ENTRIES,),
+        ).rowcount
+        connection.commit()
+        self.counters["evictions"] += evicted
+
+    def evict(self):
+        with self.lock:
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+
+    def stats(self):
+        with self.lock:
+            connection = self._connect()
+            entries = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            hits, misses = self.counters["hits"], self.counters["misses"]
+            return {
+                "entries": entries,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else None,
+                "writes": self.counters["writes"],
+                "evictions": self.counters["evictions"],
+            }
+
+
+response_cache = ResponseCache()
+
+
+class CacheRun:
+    """
+    Cache keys for the calls of one generate_quiz run. Identical prompts are
+    common within a run (every medium mcq slot asks the same thing), so each
+    repeat gets its own ordinal; regenerating the same quiz then replays the
+    same sequence of responses instead of the first one over and over.
+
+    With ``read=False`` (the teacher asked for fresh questions) the cache is not
+    consulted, but the new responses still replace the cached ones.
+    """
+
+    def __init__(self, model_name, read=True):
+        self.model_name = model_name
+        self.read = read
+        self.ordinals = Counter()
+        self.lock = threading.Lock()
+
+    def key_for(self, response_model, messages):
+        content = json.dumps(
+            [
+                self.model_name,
+                messages,
+                response_model.__name__,
+                response_model.model_json_schema(),
+            ],
+            sort_keys=True,
+        )
+        with self.lock:
+            ordinal = self.ordinals[content]
+            self.ordinals[content] += 1
+
+        return hashlib.sha256(f"{ordinal}:{content}".encode()).hexdigest()
+
+    def get(self, key, response_model):
+        if not self.read:
+            return None
+        return response_cache.get(key, response_model)
+
+    def put(self, key, response):
+        response_cache.put(key, response)
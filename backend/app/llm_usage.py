@@ -0,0 +1,166 @@
+from app.constants import *
+from app import app
+from app.models import db, LLMCallLog
+from datetime import datetime
+from sqlalchemy import case, func, insert, select
+import threading, traceback
+import numpy as np
+
+ROLLUP_COLUMNS = {
+    "course": LLMCallLog.course_id,
+    "teacher": LLMCallLog.teacher_id,
+    "model": LLMCallLog.model,
+    "response_model": LLMCallLog.response_model,
+    "question_types": LLMCallLog.question_types,
+}
+
+
+def extract_usage(completion):
+    """(prompt_tokens, completion_tokens) of an OpenAI, Anthropic or Gemini style completion."""
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        if prompt_tokens is None:
+            prompt_tokens = getattr(usage, "input_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if completion_tokens is None:
+            completion_tokens = getattr(usage, "output_tokens", None)
+        return prompt_tokens, completion_tokens
+
+    usage = getattr(completion, "usage_metadata", None)
+    if usage is not None:
+        return (
+            getattr(usage, "prompt_token_count", None),
+            getattr(usage, "candidates_token_count", None),
+        )
+
+    return None, None
+
+
+class UsageRecorder:
+    """
+    Buffers LLMCallLog rows for the calls of one generate_quiz run. Calls are
+    recorded from the worker threads; rows are written in bulk, in their own app
+    context, every LLM_USAGE_FLUSH_SIZE calls and when the run ends.
+    """
+
+    def __init__(self, model, course_id=None, teacher_id=None, job_id=None):
+        self.context = {
+            "model": model,
+            "course_id": course_id,
+            "teacher_id": teacher_id,
+            "job_id": job_id,
+        }
+        self.rows = []
+        self.lock = threading.Lock()
+
+    def record(self, response_model, question_types, status, latency, **fields):
+        row = dict(
+            self.context,
+            created_at=datetime.utcnow(),
+            response_model=response_model.__name__,
+            question_types=",".join(question_types),
+            num_questions=len(question_types),
+            status=status,
+            latency_ms=latency * 1000,
+            **fields,
+        )
+
+        with self.lock:
+            self.rows.append(row)
+            full = len(self.rows) >= LLM_USAGE_FLUSH_SIZE
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+
+        if not rows:
+            return
+
+        # Accounting must never fail a quiz, so errors are only logged.
+        try:
+            with app.app_context():
+                db.session.execute(insert(LLMCallLog), rows)
+                db.session.commit()
+        except Exception:
+            print(traceback.format_exc())
+
+
+def usage_rollup(group_by="course", since=None, until=None):
+    """
+    Call counts, token totals, retries and p50/p95/p99 latency per ``group_by``
+    (one of ROLLUP_COLUMNS). Cache hits are counted but left out of latencies.
+    """
+    column = ROLLUP_COLUMNS[group_by]
+
+    filters = []
+    if since is not None:
+        filters.append(LLMCallLog.created_at >= since)
+    if until is not None:
+        filters.append(LLMCallLog.created_at < until)
+
+    totals = db.session.execute(
+        select(
+            column,
+            func.count(),
+            func.sum(case((LLMCallLog.status == "error", 1), else_=0)),
+            func.sum(case((LLMCallLog.status == "cache_hit", 1), else_=0)),
+            func.sum(LLMCallLog.num_questions),
+            func.sum(LLMCallLog.attempts - 1),
+            func.sum(case((LLMCallLog.hedged, 1), else_=0)),
+            func.sum(LLMCallLog.validation_failures),
+            func.sum(LLMCallLog.prompt_tokens),
+            func.sum(LLMCallLog.completion_tokens),
+        )
+        .where(*filters)
+        .group_by(column)
+    ).all()
+
+    latencies = {}
+    for key, latency_ms in db.session.execute(
+        select(column, LLMCallLog.latency_ms).where(
+            LLMCallLog.status != "cache_hit", *filters
+        )
+    ):
+        latencies.setdefault(key, []).append(latency_ms)
+
+    result = []
+    for (
+        key,
+        calls,
+        errors,
+        cache_hits,
+        questions,
+        retries,
+        hedged,
+        validation_failures,
+        prompt_tokens,
+        completion_tokens,
+    ) in totals:
+        samples = latencies.get(key)
+        p50, p95, p99 = (
+            np.percentile(samples, [50, 95, 99]).round(1).tolist()
+            if samples
+            else (None, None, None)
+        )
+
+        result.append(
+            {
+                group_by: key,
+                "calls": calls,
+                "errors": errors,
+                "cache_hits": cache_hits,
+                "questions": questions,
+                "retries": retries,
+                "hedged": hedged,
+                "validation_failures": validation_failures,
+                "prompt_tokens": prompt_tokens or 0,
+                "completion_tokens": completion_tokens or 0,
+                "latency_ms": {"p50": p50, "p95": p95, "p99": p99},
+            }
+        )
+
+    return result
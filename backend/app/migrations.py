@@ -0,0 +1,133 @@
+"""
+Versioned schema changes for databases created before the change. ``db.create_all``
+only creates missing tables, so new indexes and columns on existing tables, and
+data backfills, are added here with the next version number. A fresh database
+gets the same schema from the models; its migrations then find nothing to do and
+are just recorded.
+"""
+
+from app.models import (
+    db,
+    SchemaVersion,
+    User,
+    Tests,
+    Questions,
+    QuestionTag,
+    intern_tags,
+)
+from datetime import datetime
+from sqlalchemy import inspect, insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateColumn, CreateIndex
+import json
+
+
+def create_indexes(*index_names):
+    def migrate(connection):
+        indexes = {
+            index.name: index
+            for table in db.metadata.sorted_tables
+            for index in table.indexes
+        }
+        for name in index_names:
+            connection.execute(CreateIndex(indexes[name], if_not_exists=True))
+
+    return migrate
+
+
+def add_columns(*columns):
+    def migrate(connection):
+        for column in columns:
+            table = column.table
+            existing = {c["name"] for c in inspect(connection).get_columns(table.name)}
+            if column.name in existing:
+                continue
+
+            table_name = connection.dialect.identifier_preparer.format_table(table)
+            definition = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute(
+                text(f"ALTER TABLE {table_name} ADD COLUMN {definition}")
+            )
+
+    return migrate
+
+
+def backfill_question_tags(connection, batch_size=500):
+    """question_tags rows for the questions written before the table existed."""
+    untagged = connection.execute(
+        select(Questions.question_id, Questions.tags).where(
+            Questions.question_id.not_in(select(QuestionTag.question_id))
+        )
+    ).all()
+
+    for start in range(0, len(untagged), batch_size):
+        tags = {}
+        for question_id, tags_json in untagged[start : start + batch_size]:
+            try:
+                tags[question_id] = json.loads(tags_json)
+            except (TypeError, ValueError):
+                print(f"Skipping unreadable tags of question {question_id}")
+
+        tag_ids = intern_tags(
+            connection, [tag for names in tags.values() for tag in names]
+        )
+        links = [
+            {"question_id": question_id, "tag_id": tag_ids[tag], "position": position}
+            for question_id, names in tags.items()
+            for position, tag in enumerate(names)
+        ]
+        if links:
+            connection.execute(insert(QuestionTag), links)
+
+
+MIGRATIONS = [
+    (
+        1,
+        "Indexes for attempt, enrollment, question attempt and job lookups",
+        create_indexes(
+            "ix_attempt_test_student_status",
+            "ix_attempt_student_status",
+            "ix_student_courses_course",
+            "ix_teacher_courses_course",
+            "ix_question_attempt_question",
+            "ix_jobs_status",
+        ),
+    ),
+    (2, "Backfill question_tags from Questions.tags", backfill_question_tags),
+    (
+        3,
+        "Tests.questions_version for the answer key cache",
+        add_columns(Tests.__table__.c.questions_version),
+    ),
+    (
+        4,
+        "User.updated_at for checking token claims",
+        add_columns(User.__table__.c.updated_at),
+    ),
+]
+
+
+def apply_migrations():
+    """Apply the migrations this database has not seen yet, each in its own transaction."""
+    applied = set(db.session.scalars(select(SchemaVersion.version)))
+    db.session.commit()
+
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+
+        try:
+            with db.engine.begin() as connection:
+                migrate(connection)
+                connection.execute(
+                    insert(SchemaVersion).values(
+                        version=version,
+                        description=description,
+                        applied_at=datetime.utcnow(),
+                    )
+                )
+            print(f"Applied migration {version}: {description}")
+
+        except IntegrityError:
+            # Another worker applied it first; its transaction made the same change.
+            pass
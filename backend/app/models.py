@@ -1,9 +1,10 @@
-from sqlalchemy.orm import mapped_column, relationship, validates
+from sqlalchemy.orm import Session, mapped_column, relationship, validates
 from sqlalchemy import Integer, String, DateTime, ForeignKey, Text, Float, Boolean
-from sqlalchemy import sql, event
+from sqlalchemy import sql, event, select, update
 from flask_sqlalchemy import SQLAlchemy
 from app.constants import *
-import re, json
+from datetime import datetime
+import re, json, uuid
 
 db = SQLAlchemy()
 
@@ -17,6 +18,11 @@ class User(db.Model):
     role = mapped_column(String(64), nullable=False)
     password = mapped_column(String(128), nullable=False)
     creation_time = mapped_column(DateTime, default=sql.func.now(), nullable=False)
+    # Checked by app.identity before trusting the claims of a token issued earlier.
+    # Set on insert too, so a token for a deleted user whose id is reused fails.
+    updated_at = mapped_column(
+        DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
 
 
 class Courses(db.Model):
@@ -65,7 +71,10 @@ class Teacher_Courses_Map(db.Model):
     )
     offered_at = mapped_column(String(64), nullable=False)
 
-    __table_args__ = (db.PrimaryKeyConstraint("teacher_id", "course_id", "offered_at"),)
+    __table_args__ = (
+        db.PrimaryKeyConstraint("teacher_id", "course_id", "offered_at"),
+        db.Index("ix_teacher_courses_course", "course_id", "offered_at"),
+    )
 
     course = relationship(
         "Courses",
@@ -115,7 +124,10 @@ class Student_Courses_Map(db.Model):
         String(64), ForeignKey("courses.course_id"), nullable=False
     )
     taken_at = mapped_column(DateTime, default=sql.func.now(), nullable=False)
-    __table_args__ = (db.PrimaryKeyConstraint("student_id", "course_id"),)
+    __table_args__ = (
+        db.PrimaryKeyConstraint("student_id", "course_id"),
+        db.Index("ix_student_courses_course", "course_id"),
+    )
 
 
 class Tests(db.Model):
@@ -144,6 +156,12 @@ class Tests(db.Model):
     status = mapped_column(
         String(32), nullable=False
     )  # One of NotPublished, Published, Active, Completed
+    # Replaced whenever the test's questions change; compiled answer keys are
+    # cached against it (see app.grading.AnswerKeyCache). Random rather than a
+    # counter, since SQLite may give a new test the id of a deleted one.
+    questions_version = mapped_column(
+        String(32), nullable=True, default=lambda: uuid.uuid4().hex
+    )
 
     __table_args__ = (
         db.UniqueConstraint("course_id", "title", name="uix_course_title"),
@@ -243,11 +261,13 @@ class Questions(db.Model):
         Integer, ForeignKey("tests.test_id", ondelete="CASCADE"), nullable=False
     )
     question_text = mapped_column(String(1024), nullable=False)
-    options = mapped_column(String(1024), nullable=True)
+    # JSON strings. Text rather than a sized String, since PostgreSQL enforces
+    # lengths that SQLite ignores and generated options can be long.
+    options = mapped_column(Text, nullable=True)
     correct_answer = mapped_column(
-        String(32), nullable=False
+        Text, nullable=False
     )  # e.g., 'A', 'B', 'C', 'D' or ['A','B'] for multiple correct options
-    tags = mapped_column(String(512), nullable=False)
+    tags = mapped_column(Text, nullable=False)
     marks = mapped_column(Float, nullable=False)
     difficulty_level = mapped_column(String(32), nullable=False)
     created_at = mapped_column(DateTime, default=sql.func.now(), nullable=False)
@@ -265,6 +285,15 @@ class Questions(db.Model):
         passive_deletes=True,
     )
 
+    # The same tags as rows of question_tags, for filtering and grouping in SQL
+    tag_links = relationship(
+        "QuestionTag",
+        back_populates="question",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+        order_by="QuestionTag.position",
+    )
+
     @validates("question_text")
     def validates_question_text(self, key, question_text):
         if not isinstance(question_text, str):
@@ -312,6 +341,11 @@ class Questions(db.Model):
 
         if not (isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)):
             raise ValueError("tags should be a list of strings.")
+
+        self.tag_links = [
+            QuestionTag(position=position, tag_name=tag)
+            for position, tag in enumerate(tags)
+        ]
         return json.dumps(tags)
 
     @validates("difficulty_level")
@@ -392,6 +426,261 @@ def validate_question(mapper, connection, target):
                 raise ValueError(f"MSQ correct_answer IDs {invalid_answers} are not valid options.")
 
 
+class Tag(db.Model):
+    """Interned tag names; a name is stored once however many questions carry it."""
+
+    __tablename__ = "tags"
+
+    tag_id = mapped_column(Integer, primary_key=True)
+    name = mapped_column(Text, unique=True, nullable=False)
+
+
+class QuestionTag(db.Model):
+    """A tag of a question, at its position in the question's tags list."""
+
+    __tablename__ = "question_tags"
+
+    id = mapped_column(Integer, primary_key=True)
+    question_id = mapped_column(
+        Integer, ForeignKey("questions.question_id", ondelete="CASCADE"), nullable=False
+    )
+    tag_id = mapped_column(Integer, ForeignKey("tags.tag_id"), nullable=False)
+    position = mapped_column(Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_question_tags_question", "question_id"),
+        db.Index("ix_question_tags_tag", "tag_id", "question_id"),
+    )
+
+    question = relationship("Questions", back_populates="tag_links")
+    tag = relationship("Tag")
+
+    # Set by Questions.validate_tags; resolved to tag_id when the link is flushed.
+    tag_name = None
+
+
+def dialect_insert(connection):
+    """The insert construct of the connection's dialect, which has ON CONFLICT."""
+    if connection.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def intern_tags(connection, names):
+    """{name: tag_id} for ``names``, adding the ones the tags table does not have yet."""
+    insert = dialect_insert(connection)
+
+    # Sorted, so concurrent writers take the unique index locks in the same order.
+    names = sorted(set(names))
+    if not names:
+        return {}
+
+    connection.execute(
+        insert(Tag.__table__).on_conflict_do_nothing(index_elements=["name"]),
+        [{"name": name} for name in names],
+    )
+    rows = connection.execute(select(Tag.name, Tag.tag_id).where(Tag.name.in_(names)))
+    return {name: tag_id for name, tag_id in rows}
+
+
+@event.listens_for(Session, "before_flush")
+def intern_question_tags(session, flush_context, instances):
+    links = [
+        obj
+        for obj in session.new
+        if isinstance(obj, QuestionTag) and obj.tag_id is None and obj.tag is None
+    ]
+    if not links:
+        return
+
+    tag_ids = intern_tags(session.connection(), [link.tag_name for link in links])
+    for link in links:
+        link.tag_id = tag_ids[link.tag_name]
+
+
+def touch_questions(connection, test_ids):
+    """New questions_version for the tests, for writes that bypass the ORM."""
+    test_ids = sorted(set(test_ids))
+    if test_ids:
+        connection.execute(
+            update(Tests)
+            .where(Tests.test_id.in_(test_ids))
+            .values(questions_version=uuid.uuid4().hex)
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def touch_flushed_questions(session, flush_context):
+    touch_questions(
+        session.connection(),
+        [
+            obj.test_id
+            for obj in (*session.new, *session.dirty, *session.deleted)
+            if isinstance(obj, Questions) and obj.test_id is not None
+        ],
+    )
+
+
+class QuestionBank(db.Model):
+    """
+    Reusable questions per course, drawn on before asking the model for new ones.
+    Entries are evicted by age and, beyond the per-course limit, least recently used first.
+    """
+
+    __tablename__ = "question_bank"
+
+    bank_id = mapped_column(Integer, primary_key=True)
+    course_id = mapped_column(
+        String(64), ForeignKey("courses.course_id", ondelete="CASCADE"), nullable=False
+    )
+    course_level = mapped_column(String(64), nullable=False)
+    difficulty_level = mapped_column(String(32), nullable=False)
+    question_type = mapped_column(String(32), nullable=False)
+    question_text = mapped_column(String(1024), nullable=False)
+    options = mapped_column(Text, nullable=True)  # JSON string
+    correct_answer = mapped_column(Text, nullable=False)  # JSON string
+    tags = mapped_column(Text, nullable=False)  # JSON string
+
+    created_at = mapped_column(DateTime, default=sql.func.now(), nullable=False)
+    last_used_at = mapped_column(DateTime, nullable=True)
+    use_count = mapped_column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("course_id", "question_text", name="uix_bank_question"),
+        db.Index(
+            "ix_bank_lookup",
+            "course_id",
+            "course_level",
+            "difficulty_level",
+            "question_type",
+        ),
+    )
+
+    def to_question(self):
+        return {
+            "question_text": self.question_text,
+            "options": json.loads(self.options) if self.options else None,
+            "correct_answer": json.loads(self.correct_answer),
+            "tags": json.loads(self.tags),
+        }
+
+
+class Jobs(db.Model):
+    """
+    Background job record. Jobs are persisted so that queued work survives a
+    restart and so that clients can poll status and progress.
+    """
+
+    __tablename__ = "jobs"
+
+    job_id = mapped_column(Integer, primary_key=True)
+    kind = mapped_column(
+        String(32), nullable=False
+    )  # create_quiz, add_questions, regrade
+    test_id = mapped_column(
+        Integer, ForeignKey("tests.test_id", ondelete="SET NULL"), nullable=True
+    )
+    created_by = mapped_column(Integer, ForeignKey("user.id"), nullable=False)
+    status = mapped_column(
+        String(32), nullable=False, default="queued"
+    )  # queued, running, completed, failed, cancelled
+    params = mapped_column(Text, nullable=False, default="{}")  # JSON string
+    total_items = mapped_column(Integer, default=0, nullable=False)
+    completed_items = mapped_column(Integer, default=0, nullable=False)
+    error = mapped_column(Text, nullable=True)
+
+    created_at = mapped_column(DateTime, default=sql.func.now(), nullable=False)
+    started_at = mapped_column(DateTime, nullable=True)
+    finished_at = mapped_column(DateTime, nullable=True)
+    heartbeat_at = mapped_column(DateTime, nullable=True)
+
+    __table_args__ = (db.Index("ix_jobs_status", "status"),)
+
+    @validates("kind")
+    def validate_kind(self, key, kind):
+        if kind not in ["create_quiz", "add_questions", "regrade"]:
+            raise ValueError(
+                "Job kind must be one of create_quiz, add_questions, regrade"
+            )
+        return kind
+
+    @validates("status")
+    def validate_status(self, key, status):
+        allowed_statuses = ["queued", "running", "completed", "failed", "cancelled"]
+        if status not in allowed_statuses:
+            raise ValueError(f"Status must be one of {allowed_statuses}")
+        return status
+
+    @validates("params")
+    def validate_params(self, key, params):
+        if not isinstance(params, str):
+            params = json.dumps(params)
+        return params
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "test_id": self.test_id,
+            "created_by": self.created_by,
+            "status": self.status,
+            "params": json.loads(self.params),
+            "total_items": self.total_items,
+            "completed_items": self.completed_items,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class SchemaVersion(db.Model):
+    """Migrations from app.migrations that have been applied to this database."""
+
+    __tablename__ = "schema_version"
+
+    version = mapped_column(Integer, primary_key=True, autoincrement=False)
+    description = mapped_column(String(256), nullable=False)
+    applied_at = mapped_column(DateTime, default=sql.func.now(), nullable=False)
+
+
+class LLMCallLog(db.Model):
+    """
+    One row per structured-output call made (or answered from cache) while
+    generating questions. Course, teacher and job are kept as plain ids so the
+    accounting outlives deleted courses and tests.
+    """
+
+    __tablename__ = "llm_call_log"
+
+    call_id = mapped_column(Integer, primary_key=True)
+    created_at = mapped_column(DateTime, default=sql.func.now(), nullable=False)
+    model = mapped_column(String(128), nullable=False)  # provider:model
+    response_model = mapped_column(String(64), nullable=False)
+    question_types = mapped_column(String(256), nullable=False)  # e.g. "mcq,nat"
+    num_questions = mapped_column(Integer, default=1, nullable=False)
+
+    status = mapped_column(String(16), nullable=False)  # ok, error, cache_hit
+    error = mapped_column(Text, nullable=True)
+    latency_ms = mapped_column(Float, nullable=False)
+    attempts = mapped_column(Integer, default=1, nullable=False)
+    hedged = mapped_column(Boolean, default=False, nullable=False)
+    validation_failures = mapped_column(Integer, default=0, nullable=False)
+    prompt_tokens = mapped_column(Integer, nullable=True)
+    completion_tokens = mapped_column(Integer, nullable=True)
+
+    course_id = mapped_column(String(8), nullable=True)
+    teacher_id = mapped_column(Integer, nullable=True)
+    job_id = mapped_column(Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_llm_call_log_created_at", "created_at"),
+        db.Index("ix_llm_call_log_course", "course_id", "created_at"),
+        db.Index("ix_llm_call_log_teacher", "teacher_id", "created_at"),
+    )
+
 
 # IMPROVED SCHEMA FOR STUDENT ATTEMPTS
 
@@ -433,6 +722,11 @@ class StudentTestAttempt(db.Model):
     ip_address = mapped_column(String(45), nullable=True)
     user_agent = mapped_column(String(256), nullable=True)
 
+    __table_args__ = (
+        db.Index("ix_attempt_test_student_status", "test_id", "student_id", "status"),
+        db.Index("ix_attempt_student_status", "student_id", "status"),
+    )
+
     # Relationships
     test = relationship("Tests", back_populates="attempts")
     question_attempts = relationship(
@@ -529,6 +823,7 @@ class StudentQuestionAttempt(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("attempt_id", "question_id", name="uix_attempt_question"),
+        db.Index("ix_question_attempt_question", "question_id"),
     )
 
     def check_answer(self):
@@ -604,3 +899,54 @@ class StudentQuestionAttempt(db.Model):
             result["question_text"] = self.question.question_text
 
         return result
+
+
+class ScoreAudit(db.Model):
+    """
+    A change to an attempt's score made by a regrade job, with the score, percentage
+    and pass/fail before and after and the number of its answers graded differently.
+    """
+
+    __tablename__ = "score_audit"
+
+    audit_id = mapped_column(Integer, primary_key=True)
+    job_id = mapped_column(
+        Integer, ForeignKey("jobs.job_id", ondelete="SET NULL"), nullable=True
+    )
+    test_id = mapped_column(
+        Integer, ForeignKey("tests.test_id", ondelete="CASCADE"), nullable=False
+    )
+    attempt_id = mapped_column(
+        Integer,
+        ForeignKey("student_test_attempt.attempt_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    old_score = mapped_column(Float, nullable=False)
+    new_score = mapped_column(Float, nullable=False)
+    old_percentage = mapped_column(Float, nullable=True)
+    new_percentage = mapped_column(Float, nullable=True)
+    old_passed = mapped_column(Boolean, nullable=True)
+    new_passed = mapped_column(Boolean, nullable=True)
+    changed_answers = mapped_column(Integer, default=0, nullable=False)
+    created_at = mapped_column(DateTime, default=sql.func.now(), nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_score_audit_test", "test_id", "created_at"),
+        db.Index("ix_score_audit_job", "job_id"),
+    )
+
+    def to_dict(self):
+        return {
+            "audit_id": self.audit_id,
+            "job_id": self.job_id,
+            "test_id": self.test_id,
+            "attempt_id": self.attempt_id,
+            "old_score": self.old_score,
+            "new_score": self.new_score,
+            "old_percentage": self.old_percentage,
+            "new_percentage": self.new_percentage,
+            "old_passed": self.old_passed,
+            "new_passed": self.new_passed,
+            "changed_answers": self.changed_answers,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
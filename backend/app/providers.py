@@ -0,0 +1,163 @@
+import hashlib, instructor, json, random, re, threading, time
+from collections import Counter
+from types import SimpleNamespace
+
+PROVIDERS = {}
+
+provider_settings = {
+    "provider": "instructor",
+    "model": "google/gemini-2.0-flash",
+    "options": {},
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class ProviderError(Exception):
+    pass
+
+
+def register_provider(name, factory):
+    """``factory(model, **options)`` must return an instructor-compatible client."""
+    PROVIDERS[name] = factory
+
+
+def configure_provider(provider, model, **options):
+    """Select the provider used by get_client. The client is rebuilt on next use."""
+    global _client
+
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown quiz generation provider {provider}")
+
+    with _client_lock:
+        provider_settings.update(provider=provider, model=model, options=options)
+        _client = None
+
+
+def get_client():
+    """The process-wide client for the configured provider, created on first use."""
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            factory = PROVIDERS[provider_settings["provider"]]
+            _client = factory(provider_settings["model"], **provider_settings["options"])
+        return _client
+
+
+def get_model_name():
+    return f'{provider_settings["provider"]}:{provider_settings["model"]}'
+
+
+class OfflineCompletions:
+    def __init__(self, latency, latency_jitter, failure_rate, seed):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.prompt_counts = Counter()
+        self.lock = threading.Lock()
+
+    def create(self, response_model, messages, **kwargs):
+        key = json.dumps([response_model.__name__, messages], sort_keys=True)
+
+        with self.lock:
+            occurrence = self.prompt_counts[key]
+            self.prompt_counts[key] += 1
+            delay = self.latency + self.rng.uniform(
+                -self.latency_jitter, self.latency_jitter
+            )
+            failed = self.rng.random() < self.failure_rate
+
+        if delay > 0:
+            time.sleep(delay)
+
+        if failed:
+            raise ProviderError("Offline provider simulated failure")
+
+        # The same prompt yields the same sequence of questions on every run.
+        digest = hashlib.sha256(f"{self.seed}:{occurrence}:{key}".encode()).digest()
+        n = int.from_bytes(digest[:6], "big")
+
+        if "questions" in response_model.model_fields:
+            prompt = messages[-1]["content"]
+            question_types = re.findall(r"Question \d+: type (\w+)", prompt)
+            questions = []
+            for offset, question_type in enumerate(question_types):
+                question = fake_question(question_type, n + offset)
+                question["question_type"] = question_type
+                questions.append(question)
+
+            return response_model.model_validate({"questions": questions})
+
+        annotation = response_model.model_fields["correct_answer"].annotation
+        question_type = {str: "mcq", int: "nat"}.get(annotation, "msq")
+
+        return response_model.model_validate(fake_question(question_type, n))
+
+    def create_with_completion(self, response_model, messages, **kwargs):
+        """Like instructor's: the parsed response and a raw completion with usage."""
+        response = self.create(response_model, messages, **kwargs)
+        # Roughly four characters per token.
+        usage = SimpleNamespace(
+            prompt_tokens=len(json.dumps(messages)) // 4,
+            completion_tokens=len(response.model_dump_json()) // 4,
+        )
+        return response, SimpleNamespace(usage=usage)
+
+
+class OfflineClient:
+    """
+    Deterministic stand-in for the instructor client, exposing the same
+    ``client.chat.completions.create(response_model=..., messages=...)`` and
+    ``create_with_completion`` calls.
+    Each call sleeps for ``latency`` (+/- ``latency_jitter``) seconds, fails with
+    probability ``failure_rate``, and otherwise returns a schema-valid question,
+    or a batch with one question per slot listed in the prompt.
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, failure_rate=0.0, seed=0):
+        self.chat = type("OfflineChat", (), {})()
+        self.chat.completions = OfflineCompletions(
+            latency, latency_jitter, failure_rate, seed
+        )
+
+
+FAKE_WORDS = (
+    "array graph tree heap stack queue hash sort search prime matrix vector "
+    "limit force energy motion light sound cell atom river verb noun tense"
+).split()
+
+
+def fake_question(question_type, n):
+    rng = random.Random(n)
+    words = " ".join(rng.choice(FAKE_WORDS) for _ in range(8))
+    question = {
+        "question_text": f"Placeholder question {n % 100000} about {words}?",
+        "tags": [rng.choice(FAKE_WORDS)],
+    }
+
+    if question_type == "nat":
+        question["options"] = []
+        question["correct_answer"] = n % 1000
+    else:
+        question["options"] = [
+            {"id": letter, "text": f"Option {letter}"} for letter in "ABCD"
+        ]
+        question["correct_answer"] = "A" if question_type == "mcq" else ["A", "C"]
+
+    return question
+
+
+register_provider("instructor", lambda model, **options: instructor.from_provider(model))
+register_provider(
+    "offline",
+    lambda model, **options: OfflineClient(
+        latency=float(options.get("latency", 0.0)),
+        latency_jitter=float(options.get("latency_jitter", 0.0)),
+        failure_rate=float(options.get("failure_rate", 0.0)),
+        seed=int(options.get("seed", 0)),
+    ),
+)
@@ -0,0 +1,171 @@
+from app.constants import *
+from app.models import db, QuestionBank, Questions, Tests
+from app.dedup import NearDuplicateIndex, normalize_question_text
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, update
+import json
+
+# course_id -> ((entry count, max bank_id), NearDuplicateIndex over the course's bank)
+course_indexes = {}
+
+
+class CourseQuestionBank:
+    """
+    The bank entries of one course and level, loaded once and handed out slot by
+    slot through ``take``. Pass an instance to ``generate_quiz(question_bank=...)``.
+
+    ``exclude_texts`` are questions already in the test being filled, and ``tags``
+    (optional) restricts the bank to entries sharing at least one tag.
+    """
+
+    def __init__(self, course_id, course_level, exclude_texts=(), tags=None):
+        self.course_id = course_id
+        self.course_level = course_level
+        self.taken_ids = []
+
+        if not QuestionBank.query.filter_by(course_id=course_id).first():
+            seed_bank_from_tests(course_id, course_level)
+
+        excluded = {normalize_question_text(text) for text in exclude_texts}
+        tags = set(tags or [])
+
+        self.available = defaultdict(list)
+
+        entries = QuestionBank.query.filter_by(course_id=course_id).all()
+        self.course_index = get_course_index(course_id, entries)
+
+        for entry in entries:
+            if entry.course_level != course_level:
+                continue
+            if normalize_question_text(entry.question_text) in excluded:
+                continue
+            if tags and not tags.intersection(json.loads(entry.tags)):
+                continue
+
+            self.available[
+                (entry.difficulty_level.lower(), entry.question_type.lower())
+            ].append(entry)
+
+        for candidates in self.available.values():
+            candidates.sort(
+                key=lambda e: (e.use_count, e.last_used_at or e.created_at),
+                reverse=True,
+            )
+
+    def take(self, difficulty_level, question_type):
+        """Least used matching question, or None when the bank has run out."""
+        candidates = self.available.get(
+            (difficulty_level.lower(), question_type.lower())
+        )
+        if not candidates:
+            return None
+
+        entry = candidates.pop()
+        self.taken_ids.append(entry.bank_id)
+        return entry.to_question()
+
+    def add(self, questions):
+        """Record the taken entries as used and bank the newly generated questions."""
+        if self.taken_ids:
+            db.session.execute(
+                update(QuestionBank)
+                .where(QuestionBank.bank_id.in_(self.taken_ids))
+                .values(
+                    last_used_at=datetime.utcnow(),
+                    use_count=QuestionBank.use_count + 1,
+                )
+            )
+
+        added = []
+        for question in questions:
+            # Near-duplicates of anything already banked for the course are not kept.
+            if self.course_index.add_if_new(question["question_text"]) is not None:
+                continue
+
+            entry = QuestionBank(
+                course_id=self.course_id,
+                course_level=self.course_level,
+                difficulty_level=question["difficulty_level"],
+                question_type=question["question_type"],
+                question_text=question["question_text"],
+                options=json.dumps(question.get("options")),
+                correct_answer=json.dumps(question["correct_answer"]),
+                tags=json.dumps(question["tags"]),
+            )
+            db.session.add(entry)
+            added.append(entry)
+
+        db.session.flush()
+
+        if evict_bank(self.course_id):
+            course_indexes.pop(self.course_id, None)
+        elif added and self.course_id in course_indexes:
+            (count, max_id), index = course_indexes[self.course_id]
+            stamp = (count + len(added), max([max_id] + [e.bank_id for e in added]))
+            course_indexes[self.course_id] = (stamp, index)
+
+
+def get_course_index(course_id, entries):
+    """Near-duplicate index over a course's bank, rebuilt only when the bank changed."""
+    stamp = (len(entries), max((e.bank_id for e in entries), default=0))
+
+    cached = course_indexes.get(course_id)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    index = NearDuplicateIndex(e.question_text for e in entries)
+    course_indexes[course_id] = (stamp, index)
+    return index
+
+
+def seed_bank_from_tests(course_id, course_level):
+    """Fill an empty course bank from the questions of the course's existing tests."""
+    question_objs = (
+        Questions.query.join(Tests).filter(Tests.course_id == course_id).all()
+    )
+
+    seen = set()
+    for q in question_objs:
+        key = normalize_question_text(q.question_text)
+        if key in seen:
+            continue
+
+        seen.add(key)
+        db.session.add(
+            QuestionBank(
+                course_id=course_id,
+                course_level=course_level,
+                difficulty_level=q.difficulty_level,
+                question_type=q.question_type,
+                question_text=q.question_text,
+                options=q.options or "null",
+                correct_answer=q.correct_answer,
+                tags=q.tags,
+            )
+        )
+
+    db.session.flush()
+
+
+def evict_bank(course_id):
+    """Drop entries unused for QUESTION_BANK_MAX_AGE_DAYS, then the least recently
+    used ones beyond QUESTION_BANK_MAX_PER_COURSE. Returns the number evicted."""
+    last_used = func.coalesce(QuestionBank.last_used_at, QuestionBank.created_at)
+    cutoff = datetime.utcnow() - timedelta(days=QUESTION_BANK_MAX_AGE_DAYS)
+
+    evicted = QuestionBank.query.filter(
+        QuestionBank.course_id == course_id, last_used < cutoff
+    ).delete(synchronize_session=False)
+
+    keep_ids = (
+        select(QuestionBank.bank_id)
+        .where(QuestionBank.course_id == course_id)
+        .order_by(last_used.desc(), QuestionBank.bank_id.desc())
+        .limit(QUESTION_BANK_MAX_PER_COURSE)
+    )
+    evicted += QuestionBank.query.filter(
+        QuestionBank.course_id == course_id, ~QuestionBank.bank_id.in_(keep_ids)
+    ).delete(synchronize_session=False)
+
+    return evicted
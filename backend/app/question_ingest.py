@@ -0,0 +1,246 @@
+"""
+Bulk ingestion of questions. A batch is checked column by column, once, with the
+rules of the Questions validators and validate_question, and the valid rows are
+written with one executemany instead of an ORM object each. Invalid rows are
+reported by index and skipped; they do not fail the rest of the batch.
+"""
+
+from app.models import db, Questions, QuestionTag, intern_tags, touch_questions
+from sqlalchemy import insert, select
+import json
+
+QUESTION_TYPES = {"mcq", "msq", "nat"}
+DIFFICULTY_LEVELS = {"easy", "medium", "hard"}
+MAX_QUESTION_TEXT = 1024
+DUPLICATE_QUESTION_ERROR = "question_text: already in this test"
+
+
+def check_question_text(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError("question_text must be a non-empty string")
+    if len(value) > MAX_QUESTION_TEXT:
+        raise ValueError(
+            f"question_text is longer than {MAX_QUESTION_TEXT} characters"
+        )
+    return value
+
+
+def check_question_type(value):
+    if not isinstance(value, str) or value.lower() not in QUESTION_TYPES:
+        raise ValueError("question_type should be one of mcq, msq or nat.")
+    return value
+
+
+def check_options(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = json.loads(value)
+    if not isinstance(value, list):
+        raise ValueError("Options must be JSON-serializable list")
+    return value
+
+
+def check_correct_answer(value):
+    # As Questions.validate_correct_answer: longer strings hold JSON.
+    if isinstance(value, str) and len(value) > 1:
+        value = json.loads(value)
+    if value is None:
+        raise ValueError("correct_answer is required")
+    return value
+
+
+def check_tags(value):
+    if isinstance(value, str):
+        value = json.loads(value)
+    if not (isinstance(value, list) and all(isinstance(tag, str) for tag in value)):
+        raise ValueError("tags should be a list of strings.")
+    return value
+
+
+def check_marks(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise ValueError("Marks need to be positive")
+    return value
+
+
+def check_difficulty_level(value):
+    if not isinstance(value, str) or value.lower() not in DIFFICULTY_LEVELS:
+        raise ValueError("difficulty_level should be one of easy, medium or hard.")
+    return value
+
+
+COLUMN_CHECKS = {
+    "question_text": check_question_text,
+    "question_type": check_question_type,
+    "options": check_options,
+    "correct_answer": check_correct_answer,
+    "tags": check_tags,
+    "marks": check_marks,
+    "difficulty_level": check_difficulty_level,
+}
+
+
+def check_answer_against_options(question_type, options, answer):
+    """The checks validate_question makes across the options and correct_answer."""
+    question_type = question_type.lower()
+
+    if question_type == "nat":
+        if isinstance(answer, str):
+            answer = int(answer)
+        if isinstance(answer, bool) or not isinstance(answer, int):
+            raise ValueError("NAT correct_answer must be an integer")
+        return
+
+    if not options:
+        raise ValueError(
+            f"{question_type.upper()} question requires a non-empty list of options"
+        )
+    if not all(isinstance(option, dict) and "id" in option for option in options):
+        raise ValueError("Each option needs an id")
+    option_ids = {option["id"] for option in options}
+
+    if question_type == "mcq":
+        if not isinstance(answer, str):
+            raise ValueError("MCQ correct_answer must be a single string")
+        if answer not in option_ids:
+            raise ValueError(
+                f"MCQ correct_answer '{answer}' must be one of the option IDs."
+            )
+
+    else:
+        if not (isinstance(answer, list) and all(isinstance(a, str) for a in answer)):
+            raise ValueError("MSQ correct_answer must be a list of strings")
+        invalid_answers = [a for a in answer if a not in option_ids]
+        if invalid_answers:
+            raise ValueError(
+                f"MSQ correct_answer IDs {invalid_answers} are not valid options."
+            )
+
+
+def validate_questions(items, marks=None):
+    """
+    Check ``items`` (question dicts, as the API accepts them) for insertion.
+    ``marks``, if given, replaces the marks of every item. Returns (rows, errors):
+    {index: checked column values} for the valid items, and [{"index", "error"}]
+    for the others.
+    """
+    errors = {}
+    columns = {}
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = "Question should be an object"
+
+    for column, check in COLUMN_CHECKS.items():
+        if column == "marks" and marks is not None:
+            columns[column] = {index: marks for index in range(len(items))}
+            continue
+
+        values = columns[column] = {}
+        for index, item in enumerate(items):
+            if index in errors:
+                continue
+            try:
+                values[index] = check(item.get(column))
+            except (TypeError, ValueError) as e:
+                errors[index] = f"{column}: {e}"
+
+    seen_texts = set()
+    rows = {}
+    for index in range(len(items)):
+        if index in errors:
+            continue
+
+        text = columns["question_text"][index]
+        if text in seen_texts:
+            errors[index] = "question_text: duplicated in this batch"
+            continue
+        seen_texts.add(text)
+
+        try:
+            check_answer_against_options(
+                columns["question_type"][index],
+                columns["options"][index],
+                columns["correct_answer"][index],
+            )
+        except (TypeError, ValueError) as e:
+            errors[index] = f"correct_answer: {e}"
+            continue
+
+        rows[index] = {column: columns[column][index] for column in COLUMN_CHECKS}
+
+    return rows, [{"index": i, "error": errors[i]} for i in sorted(errors)]
+
+
+def insert_questions(test_id, items, marks=None):
+    """
+    Validate ``items`` and add the valid ones to the test, with their question_tags,
+    in a few statements. Does not commit. Returns (inserted, errors): {index:
+    question_id} of the added items, and [{"index", "error"}] of the skipped ones.
+    """
+    rows, errors = validate_questions(items, marks)
+    if not rows:
+        return {}, errors
+
+    existing = set(
+        db.session.scalars(
+            select(Questions.question_text).where(
+                Questions.test_id == test_id,
+                Questions.question_text.in_(
+                    [row["question_text"] for row in rows.values()]
+                ),
+            )
+        )
+    )
+    for index in [i for i, row in rows.items() if row["question_text"] in existing]:
+        del rows[index]
+        errors.append({"index": index, "error": DUPLICATE_QUESTION_ERROR})
+    errors.sort(key=lambda error: error["index"])
+
+    if not rows:
+        return {}, errors
+
+    db.session.execute(
+        insert(Questions),
+        [
+            dict(
+                row,
+                test_id=test_id,
+                options=json.dumps(row["options"]),
+                correct_answer=json.dumps(row["correct_answer"]),
+                tags=json.dumps(row["tags"]),
+            )
+            for row in rows.values()
+        ],
+    )
+
+    # Question texts are unique within a test, so they identify the new rows.
+    # (RETURNING in parameter order would make SQLite insert row by row.)
+    question_ids = dict(
+        db.session.execute(
+            select(Questions.question_text, Questions.question_id).where(
+                Questions.test_id == test_id,
+                Questions.question_text.in_(
+                    [row["question_text"] for row in rows.values()]
+                ),
+            )
+        ).all()
+    )
+    inserted = {
+        index: question_ids[row["question_text"]] for index, row in rows.items()
+    }
+
+    tag_ids = intern_tags(
+        db.session.connection(), [tag for row in rows.values() for tag in row["tags"]]
+    )
+    links = [
+        {"question_id": inserted[index], "tag_id": tag_ids[tag], "position": position}
+        for index, row in rows.items()
+        for position, tag in enumerate(row["tags"])
+    ]
+    if links:
+        db.session.execute(insert(QuestionTag), links)
+
+    touch_questions(db.session.connection(), [test_id])
+    return inserted, errors
@@ -1,7 +1,24 @@
-import instructor
-from pydantic import BaseModel, Field, field_validator
-from typing import List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+import time, traceback
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
+from typing import List, Any, Optional, Union, Literal, Annotated
 from app.utils import get_question_type, get_question_level, get_mark_distribution
+from app.dedup import NearDuplicateIndex
+from app.providers import get_client, get_model_name
+from app.llm_cache import CacheRun, response_cache
+from app.llm_usage import UsageRecorder, extract_usage
+from app.call_policy import call_with_policy
+from app.constants import (
+    QUIZGEN_STRATEGY,
+    QUIZGEN_MAX_WORKERS,
+    QUIZGEN_DEDUP_ROUNDS,
+    QUIZGEN_BATCH_SIZE,
+    QUIZGEN_BATCH_ROUNDS,
+)
+
+
+class QuizGenerationError(Exception):
+    pass
 
 
 class Option(BaseModel):
@@ -81,16 +98,89 @@ class NumericalAnswerQuestion(BaseModel):
         raise ValueError(f"correct_answer should be a integer.")
 
 
-def generate_quiz(
-    course_name,
-    course_level,
-    course_objectives,
-    title,
-    description,
-    difficulty_level,
-    total_questions,
-    total_marks,
-):
+class BatchMultipleChoiceQuestion(MultipleChoiceQuestion):
+    question_type: Literal["mcq"] = Field(..., description="Always mcq.")
+
+
+class BatchMultipleSelectQuestion(MultipleSelectQuestion):
+    question_type: Literal["msq"] = Field(..., description="Always msq.")
+
+
+class BatchNumericalAnswerQuestion(NumericalAnswerQuestion):
+    question_type: Literal["nat"] = Field(..., description="Always nat.")
+
+
+QuestionItem = Annotated[
+    Union[
+        BatchMultipleChoiceQuestion,
+        BatchMultipleSelectQuestion,
+        BatchNumericalAnswerQuestion,
+    ],
+    Field(discriminator="question_type"),
+]
+
+question_item_adapter = TypeAdapter(QuestionItem)
+
+
+class QuestionBatch(BaseModel):
+    questions: List[QuestionItem] = Field(
+        ..., min_length=1, description="The generated questions, in the requested order."
+    )
+
+    @field_validator("questions", mode="wrap")
+    def validate_each_question(cls, questions, handler):
+        # Items are validated one at a time so that a single bad question does not
+        # reject the whole batch; invalid items become None and get regenerated.
+        if not isinstance(questions, list):
+            return handler(questions)
+
+        result = []
+        for item in questions:
+            try:
+                result.append(question_item_adapter.validate_python(item))
+            except Exception:
+                result.append(None)
+
+        if not any(result):
+            raise ValueError("None of the generated questions are valid.")
+
+        return result
+
+
+QUESTION_PROMPTS = {
+    "mcq": (
+        "The question should be a multiple choice question with single correct answer."
+        "The response should include: question_text, options, correct_answer and tags."
+        "question_text is a string dictating the question."
+        "options is a list of option, where each option has id and text. id should be of type A, B, C, D and so on. text includes the option text."
+        "correct_answer should be a single option id letter for the correct answer which should be among the options."
+        "tags is a list of strings that indicate the topic to which question belongs. Make the tags concise and general so that they can be aggregated later."
+    ),
+    "msq": (
+        "The question should be a multiple select question with one or more correct answers."
+        "The response should include: question_text, options, correct_answers and tags."
+        "question_text is a string dictating the question."
+        "options is a list of option, where each option has id and text. id should be of type A, B, C, D and so on. text includes the option text."
+        "correct_answers should be a list of option id letters for the correct answers which should be among the options."
+        "tags is a list of strings that indicate the topic to which question belongs. Make the tags concise and general so that they can be aggregated later."
+    ),
+    "nat": (
+        "The question should be a numeric answer type question with single correct answer."
+        "The response should include: question_text, correct_answer and tags."
+        "question_text is a string dictating the question."
+        "correct_answer should strictly be an integer, no decimals allowed. Format the question accordingly."
+        "tags is a list of strings that indicate the topic to which question belongs. Make the tags concise and general so that they can be aggregated later."
+    ),
+}
+
+RESPONSE_MODELS = {
+    "mcq": MultipleChoiceQuestion,
+    "msq": MultipleSelectQuestion,
+    "nat": NumericalAnswerQuestion,
+}
+
+
+def build_system_prompt(course_name, course_level, course_objectives, title, description):
     system_prompt = (
         "You generate objective exam questions strictly in JSON format."
         "Output ONLY JSON with a list of questions."
@@ -104,70 +194,479 @@ def generate_quiz(
     if description:
         system_prompt += f"Additionally, the teacher has given this specific guidance to be kept in mind: <guidance start> {description} <guidance end>."
 
-    generated_questions = []
-    questions_list = []
-    difficulty_list = []
-    question_type_list = []
+    return system_prompt
 
-    client = instructor.from_provider("google/gemini-2.0-flash")
 
-    for i in range(int(total_questions)):
-        question_level = get_question_level(difficulty_level)
-        question_type = get_question_type()
-
-        if question_type == "mcq":
-            prompt = (
-                f"Generate 1 question of the difficulty level: {question_level}."
-                "The question should be a multiple choice question with single correct answer."
-                "The response should include: question_text, options, correct_answer and tags."
-                "question_text is a string dictating the question."
-                "options is a list of option, where each option has id and text. id should be of type A, B, C, D and so on. text includes the option text."
-                "correct_answer should be a single option id letter for the correct answer which should be among the options."
-                "tags is a list of strings that indicate the topic to which question belongs. Make the tags concise and general so that they can be aggregated later."
+def build_question_prompt(question_level, question_type, avoid_questions=None):
+    prompt = f"Generate 1 question of the difficulty level: {question_level}."
+    prompt += QUESTION_PROMPTS[question_type]
+
+    if avoid_questions:
+        prompt += f"The following questions are already generated. Don't repeat them. <questions start>"
+        for i, j in enumerate(avoid_questions):
+            prompt += f"\nQuestion {i}: {j}."
+        prompt += "<questions end>"
+
+    return prompt
+
+
+def build_batch_prompt(slots, avoid_questions=None):
+    prompt = f"Generate {len(slots)} questions, in exactly this order:"
+    for n, (question_level, question_type) in enumerate(slots, 1):
+        prompt += f"\nQuestion {n}: type {question_type}, difficulty level {question_level}."
+
+    prompt += "\nEach question must set question_type to the type given for it above."
+    for question_type in sorted({question_type for _, question_type in slots}):
+        prompt += f"\nFor questions of type {question_type}: {QUESTION_PROMPTS[question_type]}"
+
+    if avoid_questions:
+        prompt += f"\nThe following questions are already generated. Don't repeat them. <questions start>"
+        for i, j in enumerate(avoid_questions):
+            prompt += f"\nQuestion {i}: {j}."
+        prompt += "<questions end>"
+
+    return prompt
+
+
+def reconcile_questions(dedup_index, questions_list, indices):
+    """
+    Check the questions at ``indices`` against ``dedup_index`` in order, indexing
+    the ones that are new. Colliding slots are emptied; returns {index: colliding text}.
+    """
+    collisions = {}
+
+    for i in indices:
+        question = questions_list[i]
+        if question is None:
+            continue
+
+        match = dedup_index.add_if_new(question["question_text"])
+        if match is not None:
+            questions_list[i] = None
+            collisions[i] = match
+
+    return collisions
+
+
+def build_messages(system_prompt, prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def create_completion(client, response_model, messages, question_types, recorder=None):
+    """
+    One structured-output call under the call policy, recorded in ``recorder``
+    (a UsageRecorder) with its latency, retries, token usage and the number of
+    ``question_types`` slots that did not come back valid.
+    """
+    stats = {}
+    start = time.monotonic()
+
+    try:
+        response, completion = call_with_policy(
+            lambda: client.chat.completions.create_with_completion(
+                response_model=response_model, messages=messages
+            ),
+            key=response_model.__name__,
+            stats=stats,
+        )
+
+    except Exception as e:
+        if recorder:
+            recorder.record(
+                response_model,
+                question_types,
+                "error",
+                time.monotonic() - start,
+                error=str(e),
+                attempts=stats.get("attempts", 1),
+                hedged=stats.get("hedged", False),
+                validation_failures=getattr(e, "n_attempts", 0),
+            )
+        raise
+
+    if recorder:
+        validation_failures = 0
+        if response_model is QuestionBatch:
+            validation_failures = sum(
+                1
+                for n, question_type in enumerate(question_types)
+                if n >= len(response.questions)
+                or response.questions[n] is None
+                or response.questions[n].question_type != question_type
+            )
+
+        prompt_tokens, completion_tokens = extract_usage(completion)
+        recorder.record(
+            response_model,
+            question_types,
+            "ok",
+            time.monotonic() - start,
+            attempts=stats.get("attempts", 1),
+            hedged=stats.get("hedged", False),
+            validation_failures=validation_failures,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+        )
+
+    return response
+
+
+def cached_response(cache_run, key, response_model, question_type, recorder=None):
+    start = time.monotonic()
+    response = cache_run.get(key, response_model)
+
+    if response is not None and recorder:
+        recorder.record(
+            response_model, [question_type], "cache_hit", time.monotonic() - start
+        )
+    return response
+
+
+def generate_question(
+    client,
+    system_prompt,
+    question_level,
+    question_type,
+    avoid_questions=None,
+    cache_run=None,
+    recorder=None,
+):
+    prompt = build_question_prompt(question_level, question_type, avoid_questions)
+    response_model = RESPONSE_MODELS[question_type]
+    messages = build_messages(system_prompt, prompt)
+
+    key = cache_run.key_for(response_model, messages) if cache_run else None
+    response = (
+        cached_response(cache_run, key, response_model, question_type, recorder)
+        if key
+        else None
+    )
+
+    if response is None:
+        response = create_completion(
+            client, response_model, messages, [question_type], recorder
+        )
+        if key:
+            cache_run.put(key, response)
+
+    return response.model_dump()
+
+
+def generate_question_batch(
+    client, system_prompt, slots, avoid_questions=None, cache_run=None, recorder=None
+):
+    """
+    Generate len(slots) questions of mixed types in a single call.
+    Returns one entry per slot, None where the model's item was invalid,
+    missing or of the wrong question type.
+    """
+    result = [None] * len(slots)
+    keys = [None] * len(slots)
+
+    # Cached per question rather than per batch, so that batches of a different
+    # make-up, and the per-question strategy, share the same entries.
+    if cache_run and not avoid_questions:
+        for n, (question_level, question_type) in enumerate(slots):
+            response_model = RESPONSE_MODELS[question_type]
+            messages = build_messages(
+                system_prompt, build_question_prompt(question_level, question_type)
+            )
+            keys[n] = cache_run.key_for(response_model, messages)
+
+            cached = cached_response(
+                cache_run, keys[n], response_model, question_type, recorder
             )
-            model = MultipleChoiceQuestion
-
-        elif question_type == "msq":
-            prompt = (
-                f"Generate 1 question of the difficulty level: {question_level}."
-                "The question should be a multiple select question with one or more correct answers."
-                "The response should include: question_text, options, correct_answers and tags."
-                "question_text is a string dictating the question."
-                "options is a list of option, where each option has id and text. id should be of type A, B, C, D and so on. text includes the option text."
-                "correct_answers should be a list of option id letters for the correct answers which should be among the options."
-                "tags is a list of strings that indicate the topic to which question belongs. Make the tags concise and general so that they can be aggregated later."
+            if cached is not None:
+                result[n] = cached.model_dump()
+
+    missing = [n for n, question in enumerate(result) if question is None]
+    if not missing:
+        return result
+
+    prompt = build_batch_prompt([slots[n] for n in missing], avoid_questions)
+    response = create_completion(
+        client,
+        QuestionBatch,
+        build_messages(system_prompt, prompt),
+        [slots[n][1] for n in missing],
+        recorder,
+    )
+
+    for m, n in enumerate(missing):
+        question_type = slots[n][1]
+        item = response.questions[m] if m < len(response.questions) else None
+        if item is None or item.question_type != question_type:
+            continue
+
+        result[n] = item.model_dump(exclude={"question_type"})
+        if keys[n]:
+            cache_run.put(
+                keys[n], RESPONSE_MODELS[question_type].model_validate(result[n])
             )
-            model = MultipleSelectQuestion
-
-        else:  # Numeric Type
-            prompt = (
-                f"Generate 1 question of the difficulty level: {question_level}."
-                "The question should be a numeric answer type question with single correct answer."
-                "The response should include: question_text, correct_answer and tags."
-                "question_text is a string dictating the question."
-                "correct_answer should strictly be an integer, no decimals allowed. Format the question accordingly."
-                "tags is a list of strings that indicate the topic to which question belongs. Make the tags concise and general so that they can be aggregated later."
+
+    return result
+
+
+def generate_per_question(
+    executor,
+    client,
+    system_prompt,
+    difficulty_list,
+    question_type_list,
+    questions_list,
+    dedup_index,
+    on_accept,
+    cache_run=None,
+    recorder=None,
+):
+    def generate(index, avoid_question=None):
+        try:
+            return generate_question(
+                client,
+                system_prompt,
+                difficulty_list[index],
+                question_type_list[index],
+                [avoid_question] if avoid_question else None,
+                cache_run,
+                recorder,
             )
-            model = NumericalAnswerQuestion
-
-        if generated_questions:
-            prompt += f"The following questions are already generated. Don't repeat them. <questions start>"
-            for i, j in enumerate(generated_questions):
-                prompt += f"\nQuestion {i}: {j}."
-            prompt += "<questions end>"
-
-        response = client.chat.completions.create(
-            response_model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt},
-            ],
+        except Exception:
+            # Retries are exhausted; the slot stays empty for a later attempt.
+            print(traceback.format_exc())
+            return None
+
+    pending = [i for i, q in enumerate(questions_list) if q is None]
+    collisions = {}
+
+    for _ in range(QUIZGEN_DEDUP_ROUNDS + 1):
+        if not pending:
+            break
+
+        regenerated = executor.map(lambda i: generate(i, collisions.get(i)), pending)
+        for i, question in zip(pending, regenerated):
+            questions_list[i] = question
+
+        # Slots still colliding after the last round stay empty, so the quiz comes
+        # out short (QuizGenerationError) rather than with a near-duplicate.
+        collisions = reconcile_questions(dedup_index, questions_list, pending)
+
+        on_accept([i for i in pending if questions_list[i] is not None])
+        pending = [i for i in pending if questions_list[i] is None]
+
+    return questions_list
+
+
+def generate_batched(
+    executor,
+    client,
+    system_prompt,
+    difficulty_list,
+    question_type_list,
+    questions_list,
+    dedup_index,
+    on_accept,
+    cache_run=None,
+    recorder=None,
+):
+    """
+    Fill the empty slots in batches of QUIZGEN_BATCH_SIZE questions per call. Items
+    that fail validation, or collide with an accepted question, are the only ones
+    sent again in the next round; anything still missing after QUIZGEN_BATCH_ROUNDS
+    falls back to one call per question.
+    """
+    pending = [i for i, q in enumerate(questions_list) if q is None]
+    collisions = {}
+
+    for _ in range(QUIZGEN_BATCH_ROUNDS):
+        if not pending:
+            break
+
+        batches = [
+            pending[i : i + QUIZGEN_BATCH_SIZE]
+            for i in range(0, len(pending), QUIZGEN_BATCH_SIZE)
+        ]
+
+        def generate(indices):
+            slots = [(difficulty_list[i], question_type_list[i]) for i in indices]
+            avoid_questions = [collisions[i] for i in indices if i in collisions]
+            try:
+                return generate_question_batch(
+                    client,
+                    system_prompt,
+                    slots,
+                    avoid_questions,
+                    cache_run,
+                    recorder,
+                )
+            except Exception:
+                print(traceback.format_exc())
+                return [None] * len(indices)
+
+        for indices, items in zip(batches, executor.map(generate, batches)):
+            for i, item in zip(indices, items):
+                questions_list[i] = item
+
+        collisions = reconcile_questions(dedup_index, questions_list, pending)
+        on_accept([i for i in pending if questions_list[i] is not None])
+
+        pending = [i for i, q in enumerate(questions_list) if q is None]
+
+    if pending:
+        generate_per_question(
+            executor,
+            client,
+            system_prompt,
+            difficulty_list,
+            question_type_list,
+            questions_list,
+            dedup_index,
+            on_accept,
+            cache_run,
+            recorder,
         )
 
-        questions_list.append(response.model_dump())
-        difficulty_list.append(question_level)
-        question_type_list.append(question_type)
-        generated_questions.append(response.model_dump()["question_text"])
+    return questions_list
+
+
+def generate_quiz(
+    course_name,
+    course_level,
+    course_objectives,
+    title,
+    description,
+    difficulty_level,
+    total_questions,
+    total_marks,
+    concurrency=None,
+    client=None,
+    strategy=None,
+    on_question=None,
+    question_bank=None,
+    dedup_index=None,
+    use_cache=True,
+    usage_context=None,
+):
+    """
+    Generate the questions of a quiz.
+
+    When a ``question_bank`` is given, slots are filled from it first and only the
+    shortfall is sent to the model; newly generated questions are added back to it.
+
+    With the "batched" strategy (QUIZGEN_STRATEGY) one call returns several
+    questions of mixed types; with "per_question" every question is its own call.
+    Either way the calls are independent, so they are sent in parallel over a
+    bounded thread pool (``concurrency`` workers, QUIZGEN_MAX_WORKERS by default).
+    Each call runs under the timeout, retry and hedging policy of app.call_policy.
+
+    Responses are cached on disk (app.llm_cache), so regenerating a quiz with the
+    same course, title, description and difficulty replays earlier completions.
+    ``use_cache=False`` asks for fresh questions.
+
+    Every call is logged to LLMCallLog (app.llm_usage); ``usage_context`` holds
+    the course_id, teacher_id and job_id the calls are attributed to.
+
+    Repeats are not prevented through the prompt. Every candidate is checked
+    against ``dedup_index`` (a NearDuplicateIndex, seeded by the caller with the
+    questions the quiz already has) and only the colliding slots are regenerated.
+
+    ``on_question(question)`` is called from the calling thread for every question
+    as soon as it is accepted (without "marks"), so the caller can persist it with
+    its own database session. If some slots still fail after all retries, a
+    QuizGenerationError is raised; the questions already passed to
+    ``on_question`` are final and only the missing ones need generating again.
+    """
+    system_prompt = build_system_prompt(
+        course_name, course_level, course_objectives, title, description
+    )
+
+    difficulty_list = []
+    question_type_list = []
+
+    for i in range(int(total_questions)):
+        difficulty_list.append(get_question_level(difficulty_level))
+        question_type_list.append(get_question_type())
+
+    questions_list = [None] * int(total_questions)
+
+    if dedup_index is None:
+        dedup_index = NearDuplicateIndex()
+
+    def on_accept(indices):
+        for i in indices:
+            questions_list[i]["difficulty_level"] = difficulty_list[i]
+            questions_list[i]["question_type"] = question_type_list[i]
+            if on_question:
+                on_question(questions_list[i])
+
+    if question_bank is not None:
+        for i in range(int(total_questions)):
+            questions_list[i] = question_bank.take(
+                difficulty_list[i], question_type_list[i]
+            )
+        reconcile_questions(dedup_index, questions_list, range(int(total_questions)))
+        on_accept([i for i, q in enumerate(questions_list) if q is not None])
+
+    pending = [i for i, q in enumerate(questions_list) if q is None]
+
+    if pending:
+        # The cache key and the usage log name the configured model, so a client
+        # passed in by the caller (benchmarks, tests) bypasses both.
+        cache_run = None
+        recorder = None
+        if client is None:
+            client = get_client()
+            recorder = UsageRecorder(get_model_name(), **(usage_context or {}))
+            if response_cache.path:
+                cache_run = CacheRun(get_model_name(), read=use_cache)
+
+        strategy = strategy or QUIZGEN_STRATEGY
+        max_workers = max(1, min(concurrency or QUIZGEN_MAX_WORKERS, len(pending)))
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                if strategy == "batched":
+                    generate_batched(
+                        executor,
+                        client,
+                        system_prompt,
+                        difficulty_list,
+                        question_type_list,
+                        questions_list,
+                        dedup_index,
+                        on_accept,
+                        cache_run,
+                        recorder,
+                    )
+                else:
+                    generate_per_question(
+                        executor,
+                        client,
+                        system_prompt,
+                        difficulty_list,
+                        question_type_list,
+                        questions_list,
+                        dedup_index,
+                        on_accept,
+                        cache_run,
+                        recorder,
+                    )
+        finally:
+            if recorder:
+                recorder.flush()
+
+    if question_bank is not None:
+        question_bank.add(
+            [questions_list[i] for i in pending if questions_list[i] is not None]
+        )
+
+    missing = sum(1 for q in questions_list if q is None)
+    if missing:
+        raise QuizGenerationError(
+            f"{missing} of {int(total_questions)} questions could not be generated"
+        )
 
     question_marks_list = get_mark_distribution(difficulty_list, int(total_marks))
 
@@ -175,8 +674,6 @@ def generate_quiz(
 
     for i in range(int(total_questions)):
         question = questions_list[i]
-        question["difficulty_level"] = difficulty_list[i]
-        question["question_type"] = question_type_list[i]
         question["marks"] = question_marks_list[i]
 
         result.append(question)
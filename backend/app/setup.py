@@ -1,3 +1,44 @@
+from app.constants import *
+from sqlalchemy import event
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # SQLite pragmas are per connection, so they are applied as each pooled
+    # connection is opened rather than on every request.
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+def set_postgres_timezone(dbapi_connection, connection_record):
+    # Timestamps are naive UTC throughout (datetime.utcnow, SQLite's now()).
+    cursor = dbapi_connection.cursor()
+    cursor.execute("SET TIME ZONE 'UTC'")
+    cursor.close()
+    dbapi_connection.commit()
+
+
+def database_url(url):
+    """Normalise DATABASE_URL; postgres:// URLs use the psycopg (v3) driver."""
+    for prefix in ["postgres://", "postgresql://"]:
+        if url.startswith(prefix):
+            return "postgresql+psycopg://" + url[len(prefix) :]
+    return url
+
+
+def configure_engine(engine):
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    elif engine.dialect.name == "postgresql":
+        event.listen(engine, "connect", set_postgres_timezone)
+
+
 def setup_db(app, db):
     with app.app_context():
+        configure_engine(db.engine)
         db.create_all()
+
+        from app.migrations import apply_migrations
+
+        apply_migrations()
@@ -0,0 +1,159 @@
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from collections import Counter
+import threading, time
+
+SLOWEST_STATEMENT_CHARS = 500
+
+
+class SQLMetrics:
+    """
+    SQL statements and time per Flask endpoint, from the engine's cursor events.
+    Each request gets a Server-Timing header with its statement count and DB time;
+    totals per endpoint are served as Prometheus text at /metrics when
+    SQL_METRICS_ENDPOINT is set; it has no authentication, so only for scraping
+    inside a private network. Statements run outside a request (background jobs)
+    are not counted.
+
+    With SQL_REPEAT_LOG_THRESHOLD above 0, a request that runs the same statement
+    more than that many times logs it, which is how N+1 query loops show up.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.repeat_threshold = 0
+
+    def init_app(self, app, engine):
+        self.repeat_threshold = app.config.get("SQL_REPEAT_LOG_THRESHOLD", 0)
+        event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+        event.listen(engine, "handle_error", self.handle_error)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        if app.config.get("SQL_METRICS_ENDPOINT"):
+            app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+
+        if not has_request_context() or "sql" not in g:
+            return
+
+        stats = g.sql
+        stats["statements"] += 1
+        stats["seconds"] += elapsed
+        if elapsed > stats["slowest_seconds"]:
+            stats["slowest_seconds"] = elapsed
+            stats["slowest"] = statement
+        if self.repeat_threshold:
+            stats["repeats"][statement] += 1
+
+    def handle_error(self, context):
+        # A failed statement gets no after_cursor_execute.
+        if context.connection is not None and context.connection.info.get(
+            "query_start"
+        ):
+            context.connection.info["query_start"].pop()
+
+    def start_request(self):
+        g.sql = {
+            "statements": 0,
+            "seconds": 0.0,
+            "slowest_seconds": 0.0,
+            "slowest": None,
+            "repeats": Counter(),
+        }
+
+    def finish_request(self, response):
+        stats = g.pop("sql", None)
+        if stats is None or request.endpoint in (None, "metrics", "static"):
+            return response
+
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={stats["seconds"] * 1000:.2f};'
+            f'desc="{stats["statements"]} statements"',
+        )
+
+        for statement, count in stats["repeats"].items():
+            if count > self.repeat_threshold:
+                print(
+                    f"Statement run {count} times in one {request.endpoint} request: "
+                    f"{statement[:SLOWEST_STATEMENT_CHARS]}"
+                )
+
+        with self.lock:
+            totals = self.endpoints.setdefault(
+                request.endpoint,
+                {
+                    "blueprint": request.blueprint or "",
+                    "requests": 0,
+                    "statements": 0,
+                    "seconds": 0.0,
+                    "max_statements": 0,
+                    "slowest_seconds": 0.0,
+                    "slowest": None,
+                },
+            )
+            totals["requests"] += 1
+            totals["statements"] += stats["statements"]
+            totals["seconds"] += stats["seconds"]
+            totals["max_statements"] = max(
+                totals["max_statements"], stats["statements"]
+            )
+            if stats["slowest_seconds"] > totals["slowest_seconds"]:
+                totals["slowest_seconds"] = stats["slowest_seconds"]
+                totals["slowest"] = stats["slowest"][:SLOWEST_STATEMENT_CHARS]
+
+        return response
+
+    def stats(self):
+        """Totals per endpoint, with the text of its slowest statement."""
+        with self.lock:
+            return {
+                endpoint: dict(totals) for endpoint, totals in self.endpoints.items()
+            }
+
+    def prometheus_text(self):
+        metrics = [
+            ("http_requests_total", "counter", "Requests served.", "requests"),
+            ("sql_statements_total", "counter", "SQL statements run.", "statements"),
+            ("sql_seconds_total", "counter", "Time in SQL statements.", "seconds"),
+            (
+                "sql_request_statements_max",
+                "gauge",
+                "Most SQL statements run by one request.",
+                "max_statements",
+            ),
+            (
+                "sql_slowest_statement_seconds",
+                "gauge",
+                "Duration of the slowest SQL statement.",
+                "slowest_seconds",
+            ),
+        ]
+        stats = self.stats()
+
+        lines = []
+        for name, kind, description, key in metrics:
+            lines.append(f"# HELP quickquiz_{name} {description}")
+            lines.append(f"# TYPE quickquiz_{name} {kind}")
+            for endpoint, totals in sorted(stats.items()):
+                labels = f'blueprint="{totals["blueprint"]}",endpoint="{endpoint}"'
+                lines.append(f"quickquiz_{name}{{{labels}}} {totals[key]}")
+
+        return "\n".join(lines) + "\n"
+
+    def metrics_view(self):
+        return Response(self.prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+
+sql_metrics = SQLMetrics()
@@ -1,16 +1,22 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from app.autosave import answer_buffer
+from app.constants import AUTOSAVE_MAX_PENDING, SUBMITTED_STATUSES
+from app.grading import answer_keys, answer_rows, grade_sheets, save_answers
+from app.identity import current_user
 from app.models import (
     db,
-    User,
     Courses,
     Student_Courses_Map,
     Tests,
     Questions,
     StudentTestAttempt,
     StudentQuestionAttempt,
+    Tag,
+    QuestionTag,
 )
-from sqlalchemy import func
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 import json
 import pytz
@@ -20,8 +26,7 @@ student_bp = Blueprint("student", __name__, url_prefix="/student")
 
 
 def get_current_student():
-    current_email = get_jwt_identity()
-    user = User.query.filter_by(email=current_email).first()
+    user = current_user()
 
     if not user:
         return None, jsonify({"error": "User not found"}), 404
@@ -214,18 +219,32 @@ def list_quizzes_for_student(course_id):
         .all()
     )
 
+    # All of the student's attempts in the course at once: (test_id, status) -> attempt_id
+    attempts = {}
+    for test_id, status, attempt_id in db.session.execute(
+        select(
+            StudentTestAttempt.test_id,
+            StudentTestAttempt.status,
+            StudentTestAttempt.attempt_id,
+        )
+        .join(Tests)
+        .where(
+            Tests.course_id == course_id,
+            StudentTestAttempt.student_id == user.id,
+            StudentTestAttempt.status.in_([*SUBMITTED_STATUSES, "in_progress"]),
+        )
+        .order_by(StudentTestAttempt.attempt_id)
+    ):
+        attempts.setdefault((test_id, status), attempt_id)
+
     result = []
     for test in tests:
-        submitted_attempt = StudentTestAttempt.query.filter_by(
-            test_id=test.test_id, student_id=user.id, status="submitted"
-        ).first()
-
-        in_progress_attempt = StudentTestAttempt.query.filter_by(
-            test_id=test.test_id, student_id=user.id, status="in_progress"
-        ).first()
+        in_progress_attempt_id = attempts.get((test.test_id, "in_progress"))
 
         is_active = is_test_active(test)
-        has_submitted = submitted_attempt is not None
+        has_submitted = any(
+            (test.test_id, status) in attempts for status in SUBMITTED_STATUSES
+        )
 
         if has_submitted:
             state = "completed"
@@ -255,10 +274,8 @@ def list_quizzes_for_student(course_id):
                 "start_time": test.start_time.isoformat() if test.start_time else None,
                 "state": state,
                 "can_attempt": can_attempt,
-                "has_in_progress": in_progress_attempt is not None,
-                "attempt_id": (
-                    in_progress_attempt.attempt_id if in_progress_attempt else None
-                ),
+                "has_in_progress": in_progress_attempt_id is not None,
+                "attempt_id": in_progress_attempt_id,
             }
         )
 
@@ -285,8 +302,10 @@ def start_attempt(test_id):
     if not enrolled:
         return jsonify({"error": "Not enrolled in this course"}), 403
 
-    submitted_attempt = StudentTestAttempt.query.filter_by(
-        test_id=test_id, student_id=user.id, status="submitted"
+    submitted_attempt = StudentTestAttempt.query.filter(
+        StudentTestAttempt.test_id == test_id,
+        StudentTestAttempt.student_id == user.id,
+        StudentTestAttempt.status.in_(SUBMITTED_STATUSES),
     ).first()
 
     if submitted_attempt:
@@ -397,6 +416,7 @@ def list_questions_for_quiz(test_id):
             attempt_id=attempt.attempt_id
         ).all()
     }
+    saved_answers.update(answer_buffer.answers(attempt.attempt_id))
 
     questions_data = []
     for q in questions:
@@ -422,8 +442,9 @@ def list_questions_for_quiz(test_id):
 @jwt_required()
 def get_quiz_live_status(test_id):
     """Lightweight endpoint for polling quiz status and duration updates."""
-    current_email = get_jwt_identity()
-    user = User.query.filter_by(email=current_email).first()
+    user = current_user()
+    if not user:
+        return jsonify({"error": "User not found"}), 404
 
     test = Tests.query.filter_by(test_id=test_id).first()
     if not test:
@@ -449,6 +470,54 @@ def get_quiz_live_status(test_id):
     )
 
 
+@student_bp.route("/save_answer/<int:attempt_id>", methods=["POST"])
+@jwt_required()
+def save_answer(attempt_id):
+    """Save one answer of an attempt in progress, to be written with others shortly"""
+    user, error_response, status_code = get_current_student()
+    if error_response:
+        return error_response, status_code
+
+    attempt = StudentTestAttempt.query.filter_by(
+        attempt_id=attempt_id, student_id=user.id, status="in_progress"
+    ).first()
+
+    if not attempt:
+        return jsonify({"error": "Active attempt not found"}), 404
+
+    if not is_test_active(attempt.test):
+        return jsonify({"error": "Test is not currently active"}), 403
+
+    data = request.get_json() or {}
+    try:
+        question_id = int(data.get("question_id"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "question_id is required"}), 400
+
+    time_spent = data.get("time_spent_seconds")
+    if time_spent is not None and (
+        isinstance(time_spent, bool)
+        or not isinstance(time_spent, int)
+        or time_spent < 0
+    ):
+        return jsonify({"error": "time_spent_seconds must be a whole number"}), 400
+
+    key = answer_keys.get(attempt.test)
+    if question_id not in key.positions:
+        return jsonify({"error": "Question not found in this test"}), 404
+
+    graded = grade_sheets(key, [{question_id: data.get("selected_options")}])
+    (row,) = answer_rows(graded, [attempt_id], [{question_id: time_spent}])
+
+    try:
+        if answer_buffer.add(row) >= AUTOSAVE_MAX_PENDING:
+            answer_buffer.flush()
+    except Exception as e:
+        return jsonify({"error": f"Failed to save answer: {str(e)}"}), 500
+
+    return jsonify({"message": "Answer saved", "question_id": question_id}), 202
+
+
 @student_bp.route("/submit_attempt/<int:attempt_id>", methods=["POST"])
 @jwt_required()
 def submit_attempt(attempt_id):
@@ -468,51 +537,44 @@ def submit_attempt(attempt_id):
     answers = data.get("answers", [])
 
     try:
-        for answer_data in answers:
-            question_id = answer_data.get("question_id")
-            selected_answer = answer_data.get("selected_options")
-
-            if question_id is None:
-                continue
-
-            question = Questions.query.filter_by(
-                question_id=question_id, test_id=attempt.test_id
-            ).first()
+        # Answers saved along the way first; those in the request replace them.
+        answer_buffer.flush([attempt_id])
 
-            if not question:
+        # Later answers to the same question replace earlier ones.
+        sheet = {}
+        for answer_data in answers:
+            try:
+                question_id = int(answer_data.get("question_id"))
+            except (TypeError, ValueError):
                 continue
+            sheet[question_id] = answer_data.get("selected_options")
+
+        # Claim the attempt before writing to it: the deadline sweep may have
+        # auto-submitted it since it was loaded, and its score stands then.
+        submitted_at = datetime.utcnow()
+        claimed = db.session.execute(
+            update(StudentTestAttempt)
+            .where(
+                StudentTestAttempt.attempt_id == attempt.attempt_id,
+                StudentTestAttempt.status == "in_progress",
+            )
+            .values(
+                status="submitted",
+                submitted_at=submitted_at,
+                time_taken_seconds=int(
+                    (submitted_at - attempt.started_at).total_seconds()
+                ),
+            )
+        )
+        if claimed.rowcount != 1:
+            db.session.rollback()
+            return jsonify({"error": "Attempt was already submitted"}), 409
 
-            question_attempt = StudentQuestionAttempt.query.filter_by(
-                attempt_id=attempt_id, question_id=question_id
-            ).first()
-
-            if question_attempt:
-                old_answer = question_attempt.selected_answer
-                question_attempt.selected_answer = json.dumps(selected_answer)
-                question_attempt.answered_at = datetime.utcnow()
-
-                if old_answer != question_attempt.selected_answer:
-                    question_attempt.answer_changed = True
-                    question_attempt.answer_change_count += 1
-            else:
-                question_attempt = StudentQuestionAttempt(
-                    attempt_id=attempt_id,
-                    question_id=question_id,
-                    selected_answer=json.dumps(selected_answer),
-                )
-                db.session.add(question_attempt)
-
-            question_attempt.question = question
-            question_attempt.check_answer()
-
-        time_taken = (datetime.utcnow() - attempt.started_at).total_seconds()
-        attempt.time_taken_seconds = int(time_taken)
+        key = answer_keys.get(attempt.test)
+        save_answers(grade_sheets(key, [sheet]), [attempt_id])
 
         attempt.calculate_score()
 
-        attempt.status = "submitted"
-        attempt.submitted_at = datetime.utcnow()
-
         db.session.commit()
 
         return (
@@ -542,7 +604,11 @@ def student_results():
     if error_response:
         return error_response, status_code
 
-    attempts = StudentTestAttempt.query.filter_by(student_id=user.id).all()
+    attempts = (
+        StudentTestAttempt.query.filter_by(student_id=user.id)
+        .options(joinedload(StudentTestAttempt.test))
+        .all()
+    )
 
     if not attempts:
         return jsonify({"results": []}), 200
@@ -555,11 +621,11 @@ def student_results():
 
     results = []
     for test_id, atts in test_attempts.items():
-        test = Tests.query.get(test_id)
+        test = atts[0].test
         if not test:
             continue
 
-        submitted_attempts = [a for a in atts if a.status == "submitted"]
+        submitted_attempts = [a for a in atts if a.status in SUBMITTED_STATUSES]
 
         best_score = None
         best_percentage = None
@@ -628,6 +694,22 @@ def student_results_for_test(test_id):
         .all()
     )
 
+    # The answers of every attempt, with their questions, in one query
+    question_attempts = {}
+    if attempts:
+        for qa in (
+            StudentQuestionAttempt.query.filter(
+                StudentQuestionAttempt.attempt_id.in_(
+                    [attempt.attempt_id for attempt in attempts]
+                )
+            )
+            .options(joinedload(StudentQuestionAttempt.question))
+            .order_by(StudentQuestionAttempt.question_id)
+        ):
+            question_attempts.setdefault(qa.attempt_id, []).append(qa)
+
+    key = answer_keys.get(test)
+
     attempts_data = []
     for attempt in attempts:
         attempt_dict = {
@@ -646,12 +728,8 @@ def student_results_for_test(test_id):
             "questions": [],
         }
 
-        question_attempts = StudentQuestionAttempt.query.filter_by(
-            attempt_id=attempt.attempt_id
-        ).all()
-
-        for qa in question_attempts:
-            question = Questions.query.get(qa.question_id)
+        for qa in question_attempts.get(attempt.attempt_id, []):
+            question = qa.question
             if not question:
                 continue
 
@@ -668,11 +746,10 @@ def student_results_for_test(test_id):
                 "answered_at": qa.answered_at.isoformat() if qa.answered_at else None,
             }
 
-            if attempt.status == "submitted":
-                qa_dict["correct_answer"] = json.loads(question.correct_answer)
-                qa_dict["options"] = (
-                    json.loads(question.options) if question.options else None
-                )
+            position = key.positions.get(qa.question_id)
+            if attempt.status in SUBMITTED_STATUSES and position is not None:
+                qa_dict["correct_answer"] = key.correct_answers[position]
+                qa_dict["options"] = key.options[position]
 
             attempt_dict["questions"].append(qa_dict)
 
@@ -706,8 +783,10 @@ def student_analytics(test_id):
     if not test:
         return jsonify({"error": "Test not found"}), 404
 
-    attempts = StudentTestAttempt.query.filter_by(
-        test_id=test_id, student_id=user.id, status="submitted"
+    attempts = StudentTestAttempt.query.filter(
+        StudentTestAttempt.test_id == test_id,
+        StudentTestAttempt.student_id == user.id,
+        StudentTestAttempt.status.in_(SUBMITTED_STATUSES),
     ).all()
 
     if not attempts:
@@ -775,8 +854,9 @@ def student_analytics(test_id):
 @student_bp.route("/quiz_analytics/<int:attempt_id>", methods=["GET"])
 @jwt_required()
 def quiz_analytics(attempt_id):
-    current_email = get_jwt_identity()
-    user = User.query.filter_by(email=current_email).first()
+    user = current_user()
+    if not user:
+        return jsonify({"error": "User not found"}), 404
 
     attempt = StudentTestAttempt.query.filter_by(
         attempt_id=attempt_id, student_id=user.id
@@ -861,19 +941,28 @@ def quiz_analytics(attempt_id):
 @student_bp.route("/course_analytics/<string:course_id>", methods=["GET"])
 @jwt_required()
 def course_analytics(course_id):
-    current_email = get_jwt_identity()
-    user = User.query.filter_by(email=current_email).first()
+    user = current_user()
+    if not user:
+        return jsonify({"error": "User not found"}), 404
 
-    attempts = (
-        db.session.query(StudentTestAttempt, Tests)
-        .join(Tests)
-        .filter(StudentTestAttempt.student_id == user.id)
-        .filter(Tests.course_id == course_id)
-        .filter(StudentTestAttempt.status == "submitted")
-        .order_by(Tests.start_time)
-        .all()
+    submitted = (
+        StudentTestAttempt.student_id == user.id,
+        Tests.course_id == course_id,
+        StudentTestAttempt.status.in_(SUBMITTED_STATUSES),
     )
 
+    attempts = db.session.execute(
+        select(
+            Tests.title,
+            Tests.total_marks,
+            StudentTestAttempt.total_score,
+            StudentTestAttempt.time_taken_seconds,
+        )
+        .join(Tests)
+        .where(*submitted)
+        .order_by(Tests.start_time, StudentTestAttempt.attempt_id)
+    ).all()
+
     if not attempts:
         return jsonify({"message": "No data"}), 200
 
@@ -881,31 +970,51 @@ def course_analytics(course_id):
     trend_scores = []
     total_time = 0
 
-    tag_agg = {}  
-
-    for att, test in attempts:
-        percentage = (
-            (att.total_score / test.total_marks * 100) if test.total_marks else 0
-        )
-        trend_labels.append(test.title)
+    for title, total_marks, total_score, time_taken_seconds in attempts:
+        percentage = (total_score / total_marks * 100) if total_marks else 0
+        trend_labels.append(title)
         trend_scores.append(percentage)
-        total_time += att.time_taken_seconds or 0
-
-        q_attempts = StudentQuestionAttempt.query.filter_by(
-            attempt_id=att.attempt_id
-        ).all()
-        for qa in q_attempts:
-            q = qa.question
-            marks = qa.marks_obtained or 0
-            try:
-                tags = json.loads(q.tags)
-                for tag in tags:
-                    if tag not in tag_agg:
-                        tag_agg[tag] = [0, 0]
-                    tag_agg[tag][0] += marks
-                    tag_agg[tag][1] += q.marks
-            except:
-                pass
+        total_time += time_taken_seconds or 0
+
+    # Marks obtained and available per tag, in the order tags are first met
+    # going through the attempts, their questions and each question's tags.
+    tagged_answers = (
+        select(
+            Tag.name.label("tag"),
+            func.coalesce(StudentQuestionAttempt.marks_obtained, 0).label("obtained"),
+            Questions.marks.label("total"),
+            func.row_number()
+            .over(
+                order_by=(
+                    Tests.start_time,
+                    StudentTestAttempt.attempt_id,
+                    Questions.question_id,
+                    QuestionTag.position,
+                )
+            )
+            .label("position"),
+        )
+        .select_from(StudentQuestionAttempt)
+        .join(Questions)
+        .join(QuestionTag)
+        .join(Tag)
+        .join(StudentTestAttempt)
+        .join(Tests, StudentTestAttempt.test_id == Tests.test_id)
+        .where(*submitted)
+        .subquery()
+    )
+    tag_agg = {
+        tag: [obtained, total]
+        for tag, obtained, total in db.session.execute(
+            select(
+                tagged_answers.c.tag,
+                func.sum(tagged_answers.c.obtained),
+                func.sum(tagged_answers.c.total),
+            )
+            .group_by(tagged_answers.c.tag)
+            .order_by(func.min(tagged_answers.c.position))
+        )
+    }
 
     weak_topics = []
     for tag, (obtained, total) in tag_agg.items():
@@ -1,14 +1,17 @@
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from flask_jwt_extended import jwt_required
+from app.identity import current_user
 from app import db, scheduler
 from app.models import (
-    User,
     Courses,
     Teacher_Courses_Map,
     Tests,
     Questions,
     StudentTestAttempt,
     StudentQuestionAttempt,
+    Jobs,
+    ScoreAudit,
+    touch_questions,
 )
 from functools import wraps
 from app.utils import (
@@ -17,8 +20,16 @@ from app.utils import (
     deactivate_test,
     recalibrate_marks,
 )
-from app.quizgen import generate_quiz
-import json, pytz, traceback
+from app.jobs import QUESTION_JOB_KINDS, enqueue_job, cancel_job, retry_job
+from app.question_ingest import insert_questions
+from app.constants import (
+    MAX_QUESTIONS,
+    JOB_STREAM_POLL_SECONDS,
+    JOB_STREAM_KEEPALIVE_SECONDS,
+    SUBMITTED_STATUSES,
+    TEST_TIMEZONE,
+)
+import json, pytz, time, traceback
 from datetime import datetime, timedelta, timezone
 import numpy as np
 
@@ -29,8 +40,7 @@ def teacher_required(func):
     @wraps(func)
     @jwt_required()
     def wrapper(*args, **kwargs):
-        user_email = get_jwt_identity()
-        user = User.query.filter_by(email=user_email).first()
+        user = current_user()
 
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -47,6 +57,29 @@ def teacher_required(func):
     return wrapper
 
 
+def active_job(test_id, kinds):
+    """The queued or running job of one of ``kinds`` for the test, if any."""
+    return Jobs.query.filter(
+        Jobs.test_id == test_id,
+        Jobs.kind.in_(kinds),
+        Jobs.status.in_(["queued", "running"]),
+    ).first()
+
+
+def generating_response(job):
+    # finalize_test rewrites the test's marks and question count when the job ends,
+    # so the questions cannot be changed or the test published before then.
+    return (
+        jsonify(
+            {
+                "error": "Questions are still being generated for this quiz.",
+                "job_id": job.job_id,
+            }
+        ),
+        409,
+    )
+
+
 @teacher_bp.route("/register_course", methods=["POST"])
 @teacher_required
 def register_course(user):
@@ -232,43 +265,31 @@ def create_quiz(user):
             status="not_published",
         )
         db.session.add(test_obj)
-        db.session.flush()
-
-        test_object = Tests.query.filter_by(course_id=course_id, title=title).first()
-        course_obj = Courses.query.filter_by(course_id=course_id).first()
-
-        result = generate_quiz(
-            course_obj.course_name,
-            course_obj.course_level,
-            course_obj.course_objectives,
-            title,
-            description,
-            difficulty_level,
-            total_questions,
-            total_marks,
-        )
-        question_objects = []
-
-        for item in result:
-            options = json.dumps(item["options"]) if "options" in item.keys() else ""
-            tags = json.dumps(item["tags"])
-            correct_answer = json.dumps(item["correct_answer"])
-            obj = Questions(
-                test_id=test_object.test_id,
-                question_text=item["question_text"],
-                question_type=item["question_type"],
-                options=options,
-                correct_answer=correct_answer,
-                tags=tags,
-                marks=item["marks"],
-                difficulty_level=item["difficulty_level"],
-            )
-            question_objects.append(obj)
-
-        db.session.add_all(question_objects)
         db.session.commit()
 
-        return jsonify({"message": f"Test {title} created successfully."}), 201
+        job = enqueue_job(
+            "create_quiz",
+            created_by=user.id,
+            test_id=test_obj.test_id,
+            total_items=test_obj.total_questions,
+            params={
+                "tags": data.get("tags", None),
+                "use_question_bank": data.get("use_question_bank", True),
+                "fresh": data.get("fresh", False),
+            },
+        )
+
+        return (
+            jsonify(
+                {
+                    "message": f"Test {title} is being generated.",
+                    "test_id": test_obj.test_id,
+                    "job_id": job.job_id,
+                    "stream_url": f"/teacher/quiz_jobs/{job.job_id}/stream",
+                }
+            ),
+            202,
+        )
 
     except ValueError as e:
         print(traceback.format_exc())
@@ -280,6 +301,187 @@ def create_quiz(user):
         return jsonify({"error": f"Could not create quiz. Exception: {str(e)}"}), 500
 
 
+@teacher_bp.route("/quiz_jobs", methods=["GET"])
+@teacher_required
+def list_quiz_jobs(user):
+    jobs_query = Jobs.query.filter_by(created_by=user.id)
+
+    test_id = request.args.get("test_id", None)
+    if test_id is not None:
+        jobs_query = jobs_query.filter_by(test_id=test_id)
+
+    jobs = jobs_query.order_by(Jobs.created_at.desc()).all()
+    return jsonify([job.to_dict() for job in jobs]), 200
+
+
+@teacher_bp.route("/quiz_jobs/<int:job_id>", methods=["GET"])
+@teacher_required
+def get_quiz_job(user, job_id):
+    job = Jobs.query.filter_by(created_by=user.id, job_id=job_id).first()
+    if not job:
+        return (
+            jsonify({"error": f"Job with ID: {job_id} not found for current user."}),
+            404,
+        )
+
+    return jsonify(job.to_dict()), 200
+
+
+@teacher_bp.route("/quiz_jobs/<int:job_id>/cancel", methods=["POST"])
+@teacher_required
+def cancel_quiz_job(user, job_id):
+    job = Jobs.query.filter_by(created_by=user.id, job_id=job_id).first()
+    if not job:
+        return (
+            jsonify({"error": f"Job with ID: {job_id} not found for current user."}),
+            404,
+        )
+
+    try:
+        cancel_job(job)
+        return jsonify({"message": "Job cancelled."}), 200
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@teacher_bp.route("/quiz_jobs/<int:job_id>/retry", methods=["POST"])
+@teacher_required
+def retry_quiz_job(user, job_id):
+    job = Jobs.query.filter_by(created_by=user.id, job_id=job_id).first()
+    if not job:
+        return (
+            jsonify({"error": f"Job with ID: {job_id} not found for current user."}),
+            404,
+        )
+
+    try:
+        retry_job(job)
+        return (
+            jsonify(
+                {
+                    "message": f"Retrying the {job.total_items - job.completed_items} missing questions.",
+                    "job_id": job.job_id,
+                }
+            ),
+            202,
+        )
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+def sse_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+@teacher_bp.route("/quiz_jobs/<int:job_id>/stream", methods=["GET"])
+@teacher_required
+def stream_quiz_job(user, job_id):
+    """
+    Server-Sent Events for a job: "progress" events as the job advances and a final
+    "summary" event once it ends. For a generation job, also a "question" event for
+    every question of the test as soon as it is persisted, and the recalibrated
+    marks in the summary; for a regrade, the number of scores changed.
+
+    Question events carry the question_id as their event id, so a reconnecting
+    client (Last-Event-ID header, or ?after=<question_id>) only gets new ones.
+    """
+    job = Jobs.query.filter_by(created_by=user.id, job_id=job_id).first()
+    if not job:
+        return (
+            jsonify({"error": f"Job with ID: {job_id} not found for current user."}),
+            404,
+        )
+
+    try:
+        last_question_id = int(
+            request.headers.get("Last-Event-ID") or request.args.get("after") or 0
+        )
+    except ValueError:
+        return (
+            jsonify({"error": "Last-Event-ID and after must be a question ID."}),
+            400,
+        )
+
+    def generate():
+        nonlocal last_question_id
+        last_completed = None
+        last_sent = time.monotonic()
+
+        while True:
+            # End the read transaction so that the job's commits become visible.
+            db.session.rollback()
+
+            job = db.session.get(Jobs, job_id)
+            finished = job.status not in ["queued", "running"]
+
+            question_objs = []
+            if job.test_id is not None and job.kind in QUESTION_JOB_KINDS:
+                question_objs = (
+                    Questions.query.filter(
+                        Questions.test_id == job.test_id,
+                        Questions.question_id > last_question_id,
+                    )
+                    .order_by(Questions.question_id)
+                    .all()
+                )
+
+            for question_obj in question_objs:
+                question = question_obj.to_dict(include_answer=True)
+                # Marks are only final in the summary.
+                question.pop("marks")
+                yield sse_event("question", question, question_obj.question_id)
+                last_question_id = question_obj.question_id
+                last_sent = time.monotonic()
+
+            if job.completed_items != last_completed:
+                last_completed = job.completed_items
+                yield sse_event(
+                    "progress",
+                    {
+                        "status": job.status,
+                        "completed_items": job.completed_items,
+                        "total_items": job.total_items,
+                    },
+                )
+                last_sent = time.monotonic()
+
+            if finished:
+                summary = job.to_dict()
+                test_obj = (
+                    db.session.get(Tests, job.test_id) if job.test_id is not None else None
+                )
+                if job.kind == "regrade":
+                    summary["score_changes"] = ScoreAudit.query.filter_by(
+                        job_id=job.job_id
+                    ).count()
+                elif test_obj:
+                    summary["total_marks"] = test_obj.total_marks
+                    summary["marks"] = {
+                        q.question_id: q.marks
+                        for q in Questions.query.filter_by(test_id=test_obj.test_id)
+                    }
+                yield sse_event("summary", summary)
+                return
+
+            if time.monotonic() - last_sent >= JOB_STREAM_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+
+            time.sleep(JOB_STREAM_POLL_SECONDS)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @teacher_bp.route("/list_quiz/<course_id>", methods=["GET"])
 @teacher_required
 def list_quiz(user, course_id):
@@ -315,7 +517,7 @@ def publish_quiz(user, quiz_id):
         data = request.get_json()
         start_time_str = data["start_time"]
         start_time = datetime.fromisoformat(start_time_str)
-        local_tz = pytz.timezone("Asia/Kolkata")
+        local_tz = pytz.timezone(TEST_TIMEZONE)
         start_time = local_tz.localize(start_time)
         now = datetime.now(local_tz)
 
@@ -335,6 +537,10 @@ def publish_quiz(user, quiz_id):
                 400,
             )
 
+        generating = active_job(test_obj.test_id, QUESTION_JOB_KINDS)
+        if generating:
+            return generating_response(generating)
+
         test_obj.status = "published"
         test_obj.start_time = start_time
 
@@ -433,6 +639,10 @@ def delete_questions(user, quiz_id):
                 400,
             )
 
+        generating = active_job(test_obj.test_id, QUESTION_JOB_KINDS)
+        if generating:
+            return generating_response(generating)
+
         data = request.get_json()
         question_ids = data["question_ids"]
 
@@ -451,6 +661,7 @@ def delete_questions(user, quiz_id):
         test_obj.total_marks -= sum(marks)
 
         Questions.query.filter(Questions.question_id.in_(question_ids)).delete()
+        touch_questions(db.session.connection(), [test_obj.test_id])
 
         db.session.commit()
 
@@ -478,6 +689,10 @@ def modify_quiz(user, quiz_id):
                 400,
             )
 
+        generating = active_job(test_obj.test_id, QUESTION_JOB_KINDS)
+        if generating:
+            return generating_response(generating)
+
         quiz_update_data = request.get_json()
         test_obj = Tests.query.get(quiz_id)
 
@@ -487,6 +702,8 @@ def modify_quiz(user, quiz_id):
 
         if new_num_questions < 0:
             return jsonify({"error": "Number of questions cannot be negative."}), 400
+        if new_num_questions > MAX_QUESTIONS:
+            return jsonify({"error": f"Maximum of {MAX_QUESTIONS} allowed"}), 400
 
         new_total_marks = (
             quiz_update_data["total_marks"]
@@ -497,56 +714,6 @@ def modify_quiz(user, quiz_id):
         if new_total_marks < 0:
             return jsonify({"error": "Total marks cannot be negative."}), 400
 
-        if old_num_questions < new_num_questions:
-
-            course_obj = Courses.query.filter_by(course_id=test_obj.course_id).first()
-
-            question_objs = Questions.query.filter_by(test_id=quiz_id).all()
-            old_questions = ".\n".join([q.question_text for q in question_objs])
-            description = (
-                test_obj.description
-                + ". These are the old questions, do not repeat them: <questions_start>"
-                + old_questions
-                + "<questions_end>"
-            )
-
-            result = generate_quiz(
-                course_obj.course_name,
-                course_obj.course_level,
-                course_obj.course_objectives,
-                test_obj.title,
-                description,
-                test_obj.difficulty_level,
-                new_num_questions - old_num_questions,
-                new_total_marks,
-            )
-            question_objects = []
-
-            for item in result:
-                options = (
-                    json.dumps(item["options"]) if "options" in item.keys() else ""
-                )
-                tags = json.dumps(item["tags"])
-                correct_answer = (
-                    item["correct_answer"]
-                    if item["question_type"] == "nat"
-                    else json.dumps(item["correct_answer"])
-                )
-
-                obj = Questions(
-                    test_id=quiz_id,
-                    question_text=item["question_text"],
-                    question_type=item["question_type"],
-                    options=options,
-                    correct_answer=correct_answer,
-                    tags=tags,
-                    marks=item["marks"],
-                    difficulty_level=item["difficulty_level"],
-                )
-                question_objects.append(obj)
-
-            db.session.add_all(question_objects)
-
         if old_num_questions > new_num_questions:
             for q in Questions.query.filter_by(test_id=quiz_id).limit(
                 old_num_questions - new_num_questions
@@ -557,7 +724,11 @@ def modify_quiz(user, quiz_id):
         recalibrate_marks(quiz_id, new_total_marks)
 
         if "total_questions" in quiz_update_data:
-            quiz_update_data["total_questions"] = new_num_questions
+            if old_num_questions < new_num_questions:
+                # The generation job sets total_questions once the questions exist.
+                quiz_update_data.pop("total_questions")
+            else:
+                quiz_update_data["total_questions"] = new_num_questions
 
         for field in [
             "title",
@@ -573,6 +744,32 @@ def modify_quiz(user, quiz_id):
 
         db.session.commit()
 
+        if old_num_questions < new_num_questions:
+            job = enqueue_job(
+                "add_questions",
+                created_by=user.id,
+                test_id=test_obj.test_id,
+                total_items=new_num_questions - old_num_questions,
+                params={
+                    "tags": quiz_update_data.get("tags", None),
+                    "use_question_bank": quiz_update_data.get(
+                        "use_question_bank", True
+                    ),
+                    "fresh": quiz_update_data.get("fresh", False),
+                },
+            )
+
+            return (
+                jsonify(
+                    {
+                        "message": "Modified quiz object, new questions are being generated.",
+                        "job_id": job.job_id,
+                        "stream_url": f"/teacher/quiz_jobs/{job.job_id}/stream",
+                    }
+                ),
+                202,
+            )
+
         return jsonify({"message": "Modified quiz object successfully."}), 200
 
     except Exception as e:
@@ -598,45 +795,121 @@ def add_quiz_questions(user, quiz_id):
                 400,
             )
 
+        generating = active_job(test_obj.test_id, QUESTION_JOB_KINDS)
+        if generating:
+            return generating_response(generating)
+
         data = request.get_json()
         if not isinstance(data, list):
             return jsonify({"error": "Payload should be list of question objects"}), 400
 
-        questions = []
-        marks_to_add = 0
-
-        for item in data:
-            obj = Questions(
-                test_id=quiz_id,
-                question_text=item.get("question_text", ""),
-                question_type=item.get("question_type", None),
-                options=item.get("options", None),
-                correct_answer=item.get("correct_answer", None),
-                tags=item.get("tags", None),
-                marks=item.get("marks", None),
-                difficulty_level=item.get("difficulty_level", None),
-            )
-            m = item.get("marks", 0)
-            if m <= 0:
-                return jsonify({"error": "Marks need to be positive"}), 400
+        # Invalid questions are reported by index; the valid ones are still added.
+        inserted, errors = insert_questions(test_obj.test_id, data)
+        if not inserted:
+            db.session.rollback()
+            return jsonify({"error": "No valid questions to add.", "errors": errors}), 400
 
-            marks_to_add += m
-            questions.append(obj)
+        test_obj.total_questions += len(inserted)
+        test_obj.total_marks += sum(data[index]["marks"] for index in inserted)
 
-        db.session.add_all(questions)
+        db.session.commit()
 
-        test_obj.total_questions += len(questions)
-        test_obj.total_marks += marks_to_add
+        return (
+            jsonify(
+                {
+                    "message": "Questions added successfully.",
+                    "question_ids": list(inserted.values()),
+                    "errors": errors,
+                }
+            ),
+            201,
+        )
 
-        db.session.commit()
+    except Exception as e:
+        print(traceback.format_exc())
+        return jsonify({"error": f"Exception occurred: {e}"}), 400
 
-        return jsonify({"message": "Questions added successfully."}), 201
+
+@teacher_bp.route("/regrade_quiz/<quiz_id>", methods=["POST"])
+@teacher_required
+def regrade_quiz(user, quiz_id):
+    """
+    Start a job regrading the quiz's submitted attempts against its current questions
+    and marks. Score changes are listed by /teacher/score_audit/<quiz_id>.
+    """
+    try:
+        test_obj = Tests.query.filter_by(created_by=user.id, test_id=quiz_id).first()
+        if not test_obj:
+            return (
+                jsonify(
+                    {"error": f"Quiz with ID: {quiz_id} not found for current user."}
+                ),
+                400,
+            )
+
+        running = active_job(test_obj.test_id, ["regrade"])
+        if running:
+            return (
+                jsonify(
+                    {
+                        "error": "Quiz is already being regraded.",
+                        "job_id": running.job_id,
+                    }
+                ),
+                409,
+            )
+
+        attempts = StudentTestAttempt.query.filter(
+            StudentTestAttempt.test_id == test_obj.test_id,
+            StudentTestAttempt.status.in_(SUBMITTED_STATUSES),
+        ).count()
+        if not attempts:
+            return jsonify({"error": "No submitted attempts to regrade."}), 400
+
+        job = enqueue_job(
+            "regrade",
+            created_by=user.id,
+            test_id=test_obj.test_id,
+            total_items=attempts,
+            params={},
+        )
+
+        return (
+            jsonify(
+                {
+                    "message": f"Regrading {attempts} attempts.",
+                    "job_id": job.job_id,
+                    "stream_url": f"/teacher/quiz_jobs/{job.job_id}/stream",
+                }
+            ),
+            202,
+        )
 
     except Exception as e:
         print(traceback.format_exc())
         return jsonify({"error": f"Exception occurred: {e}"}), 400
 
 
+@teacher_bp.route("/score_audit/<quiz_id>", methods=["GET"])
+@teacher_required
+def score_audit(user, quiz_id):
+    test_obj = Tests.query.filter_by(created_by=user.id, test_id=quiz_id).first()
+    if not test_obj:
+        return (
+            jsonify({"error": f"Quiz with ID: {quiz_id} not found for current user."}),
+            400,
+        )
+
+    audit_query = ScoreAudit.query.filter_by(test_id=test_obj.test_id)
+
+    job_id = request.args.get("job_id", None)
+    if job_id is not None:
+        audit_query = audit_query.filter_by(job_id=job_id)
+
+    audits = audit_query.order_by(ScoreAudit.audit_id.desc()).all()
+    return jsonify([audit.to_dict() for audit in audits]), 200
+
+
 @teacher_bp.route("/delete_quiz/<quiz_id>", methods=["POST"])
 @teacher_required
 def delete_quiz(user, quiz_id):
@@ -702,8 +975,9 @@ def delete_course(user, course_id):
 @teacher_bp.route("/quiz_analytics/<int:quiz_id>", methods=["GET"])
 @jwt_required()
 def get_teacher_quiz_analytics(quiz_id):
-    attempts = StudentTestAttempt.query.filter_by(
-        test_id=quiz_id, status="submitted"
+    attempts = StudentTestAttempt.query.filter(
+        StudentTestAttempt.test_id == quiz_id,
+        StudentTestAttempt.status.in_(SUBMITTED_STATUSES),
     ).all()
 
     if not attempts:
@@ -1,7 +1,11 @@
 from app.constants import *
-from app import db, app
-from app.models import Tests, Questions
-import datetime, random
+from app import db, app, scheduler
+from app.autosave import answer_buffer
+from app.grading import auto_submit_attempts
+from app.models import Tests, Questions, StudentTestAttempt
+from sqlalchemy import select
+import datetime, random, traceback
+import pytz
 
 
 def get_current_semester_and_year():
@@ -89,16 +93,100 @@ def deactivate_test(quiz_id):
         test_obj.status = "completed"
         db.session.commit()
 
+    # Attempts left in progress are submitted once every worker has flushed the
+    # answers it buffered before the deadline.
+    deadline = datetime.datetime.utcnow()
+    scheduler.add_job(
+        auto_submit_test,
+        "date",
+        id=f"auto_submit_test_{quiz_id}",
+        run_date=datetime.datetime.now()
+        + datetime.timedelta(seconds=AUTO_SUBMIT_GRACE_SECONDS),
+        args=[quiz_id, deadline],
+        replace_existing=True,
+    )
+
+
+def auto_submit_test(quiz_id, deadline):
+    with app.app_context():
+        try:
+            answer_buffer.flush()
+            test_obj = db.session.get(Tests, quiz_id)
+            if not test_obj:
+                return
+
+            count = auto_submit_attempts(test_obj, deadline)
+            db.session.commit()
+            if count:
+                print(f"Auto-submitted {count} attempts of test {quiz_id}")
+
+        except Exception:
+            db.session.rollback()
+            print(traceback.format_exc())
+
+
+def test_end_time(test_obj):
+    """When the test closes, as naive UTC, or None if it was never scheduled."""
+    if test_obj.start_time is None or test_obj.duration_minutes is None:
+        return None
+
+    start_time = test_obj.start_time
+    if start_time.tzinfo is None:
+        start_time = pytz.timezone(TEST_TIMEZONE).localize(start_time)
+    start_time = start_time.astimezone(pytz.UTC).replace(tzinfo=None)
+
+    return start_time + datetime.timedelta(minutes=int(test_obj.duration_minutes))
+
+
+def resume_auto_submits():
+    """
+    Schedule auto_submit_test again for tests that closed within
+    AUTO_SUBMIT_RESUME_WINDOW_SECONDS and still have attempts in progress: the job
+    only lives in the scheduler of the process that closed the test, so a restart
+    within AUTO_SUBMIT_GRACE_SECONDS drops it. Attempts are submitted as of the
+    test's end time, not the restart.
+    """
+    with app.app_context():
+        tests = Tests.query.filter(
+            Tests.status == "completed",
+            Tests.test_id.in_(
+                select(StudentTestAttempt.test_id).where(
+                    StudentTestAttempt.status == "in_progress"
+                )
+            ),
+        ).all()
+
+        now = datetime.datetime.utcnow()
+        oldest = now - datetime.timedelta(seconds=AUTO_SUBMIT_RESUME_WINDOW_SECONDS)
+        for test_obj in tests:
+            end_time = test_end_time(test_obj)
+            if end_time is None or end_time < oldest:
+                continue
+
+            scheduler.add_job(
+                auto_submit_test,
+                "date",
+                id=f"auto_submit_test_{test_obj.test_id}",
+                run_date=datetime.datetime.now()
+                + datetime.timedelta(seconds=AUTO_SUBMIT_GRACE_SECONDS),
+                args=[test_obj.test_id, min(end_time, now)],
+                replace_existing=True,
+            )
+
+
+def distribute_marks(question_objs, total_marks):
+    difficulty_list = [obj.difficulty_level for obj in question_objs]
+
+    question_marks_list = get_mark_distribution(difficulty_list, int(total_marks))
+
+    for obj, new_marks in zip(question_objs, question_marks_list):
+        obj.marks = new_marks
+
 
 def recalibrate_marks(quiz_id, total_marks):
     with app.app_context():
         question_objs = Questions.query.filter_by(test_id=quiz_id).all()
-        difficulty_list = [obj.difficulty_level for obj in question_objs]
-
-        question_marks_list = get_mark_distribution(difficulty_list, int(total_marks))
-
-        for obj, new_marks in zip(question_objs, question_marks_list):
-            obj.marks = new_marks
+        distribute_marks(question_objs, total_marks)
 
         db.session.commit()
 
@@ -0,0 +1,131 @@
+# Run from the backend directory: python -m tests.benchmarkAutoSubmit
+#
+# Closes a test whose whole class is still in progress, with the answers saved so
+# far, on a scratch SQLite file: once attempt by attempt through the ORM (check_answer
+# and calculate_score, as submit_attempt did) and once with
+# app.grading.auto_submit_attempts. Reports the time and SQL statements taken, and
+# checks that both give every attempt the same score.
+
+from tests.support import clear_tables, add_teacher_and_course, add_test, measured
+import json, random, sys
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from app import app
+from app.grading import auto_submit_attempts
+from app.models import db, User, Tests, StudentTestAttempt, StudentQuestionAttempt
+
+STUDENT_COUNTS = [50, 500]
+QUESTIONS = 20
+ANSWERED = 0.8
+
+
+def seed(students):
+    clear_tables()
+    rng = random.Random(students)
+    teacher = add_teacher_and_course()
+    test, questions = add_test(
+        teacher,
+        "BENCH1",
+        QUESTIONS,
+        marks=2,
+        start_time=datetime.utcnow() - timedelta(hours=1),
+    )
+
+    db.session.execute(
+        insert(User),
+        [
+            {
+                "name": f"S{n}",
+                "email": f"s{n}@bench.in",
+                "role": "student",
+                "password": "x",
+            }
+            for n in range(students)
+        ],
+    )
+    student_ids = [u.id for u in User.query.filter_by(role="student")]
+    db.session.execute(
+        insert(StudentTestAttempt),
+        [
+            {
+                "student_id": student_id,
+                "test_id": test.test_id,
+                "status": "in_progress",
+                "started_at": datetime.utcnow() - timedelta(minutes=rng.randint(5, 60)),
+            }
+            for student_id in student_ids
+        ],
+    )
+
+    answers = []
+    for attempt in StudentTestAttempt.query:
+        for question, kind in questions:
+            if rng.random() > ANSWERED:
+                continue
+            selected = {
+                "mcq": lambda: rng.choice("ABCD"),
+                "msq": lambda: rng.sample("ABCD", rng.randint(1, 3)),
+                "nat": lambda: rng.choice([3, 3.001, 4]),
+            }[kind]()
+            # Saved answers are graded as they come in; leave some ungraded.
+            answers.append(
+                {
+                    "attempt_id": attempt.attempt_id,
+                    "question_id": question.question_id,
+                    "selected_answer": json.dumps(selected),
+                    "marks_obtained": 0.0,
+                }
+            )
+    db.session.execute(insert(StudentQuestionAttempt), answers)
+    db.session.commit()
+    return test.test_id
+
+
+def close_orm(test_id):
+    now = datetime.utcnow()
+    for attempt in StudentTestAttempt.query.filter_by(
+        test_id=test_id, status="in_progress"
+    ):
+        for question_attempt in attempt.question_attempts:
+            question_attempt.check_answer()
+        attempt.calculate_score()
+        attempt.time_taken_seconds = int((now - attempt.started_at).total_seconds())
+        attempt.status = "auto_submitted"
+        attempt.submitted_at = now
+    db.session.commit()
+
+
+def close_bulk(test_id):
+    auto_submit_attempts(db.session.get(Tests, test_id), datetime.utcnow())
+    db.session.commit()
+
+
+def scores(test_id):
+    return [
+        (a.attempt_id, a.status, round(a.total_score, 6), a.percentage, a.passed)
+        for a in StudentTestAttempt.query.filter_by(test_id=test_id).order_by(
+            StudentTestAttempt.attempt_id
+        )
+    ]
+
+
+def measure(close, students):
+    test_id = seed(students)
+    _, elapsed, statements = measured(close, test_id)
+    return elapsed, len(statements), scores(test_id)
+
+
+failed = False
+print(f"{'students':>8} {'path':>5} {'seconds':>8} {'statements':>11}")
+with app.app_context():
+    for students in STUDENT_COUNTS:
+        results = {}
+        for name, close in [("orm", close_orm), ("bulk", close_bulk)]:
+            elapsed, statements, results[name] = measure(close, students)
+            print(f"{students:>8} {name:>5} {elapsed:>8.3f} {statements:>11}")
+
+        if results["orm"] != results["bulk"]:
+            print(f"Scores differ for {students} students")
+            failed = True
+
+sys.exit(1 if failed else 0)
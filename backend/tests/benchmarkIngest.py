@@ -0,0 +1,101 @@
+# Run from the backend directory: python -m tests.benchmarkIngest
+#
+# Adds batches of questions to a test on a scratch SQLite file, once as ORM objects
+# (validators, then validate_question and tag interning at flush) and once through
+# app.question_ingest.insert_questions, and reports questions per second and SQL
+# statements per batch.
+
+from tests.support import scratch_app, add_teacher_and_course, add_test, measured
+import time
+from app.models import db, User, Questions
+from app.question_ingest import insert_questions
+
+BATCH_SIZES = [20, 1000]
+REPEATS = 5
+
+
+def make_test():
+    test, _ = add_test(
+        User.query.first(),
+        "BENCH1",
+        0,
+        title=f"Benchmark Quiz {time.perf_counter_ns()}",
+        start_time=None,
+        status="not_published",
+    )
+    db.session.commit()
+    return test.test_id
+
+
+def make_items(size):
+    kinds = ["mcq", "msq", "nat"]
+    items = []
+    for n in range(size):
+        kind = kinds[n % 3]
+        items.append(
+            {
+                "question_text": f"Benchmark question {n}",
+                "question_type": kind,
+                "options": (
+                    [{"id": letter, "text": f"Option {letter}"} for letter in "ABCD"]
+                    if kind != "nat"
+                    else []
+                ),
+                "correct_answer": {"mcq": "A", "msq": ["A", "C"], "nat": n}[kind],
+                "tags": [f"topic {n % 25}", "benchmark"],
+                "marks": 1,
+                "difficulty_level": "medium",
+            }
+        )
+    return items
+
+
+def add_orm(test_id, items):
+    db.session.add_all(
+        [
+            Questions(
+                test_id=test_id,
+                question_text=item["question_text"],
+                question_type=item["question_type"],
+                options=item["options"],
+                correct_answer=item["correct_answer"],
+                tags=item["tags"],
+                marks=item["marks"],
+                difficulty_level=item["difficulty_level"],
+            )
+            for item in items
+        ]
+    )
+    db.session.commit()
+
+
+def add_bulk(test_id, items):
+    inserted, errors = insert_questions(test_id, items)
+    assert not errors, errors
+    db.session.commit()
+
+
+def measure(add, size):
+    items = make_items(size)
+    elapsed = 0.0
+    statements = 0
+
+    for _ in range(REPEATS):
+        _, seconds, run = measured(add, make_test(), items)
+        elapsed += seconds
+        statements += len(run)
+
+    return size * REPEATS / elapsed, statements / REPEATS
+
+
+bench_app = scratch_app()
+
+print(f"{'questions':>9} {'path':>5} {'questions/s':>12} {'statements':>11}")
+with bench_app.app_context():
+    add_teacher_and_course()
+    db.session.commit()
+
+    for size in BATCH_SIZES:
+        for name, add in [("orm", add_orm), ("bulk", add_bulk)]:
+            rate, statements = measure(add, size)
+            print(f"{size:>9} {name:>5} {rate:>12.0f} {statements:>11.0f}")
@@ -0,0 +1,40 @@
+# Run from the backend directory: python -m tests.benchmarkQuizgen
+
+import tests.support
+import time
+from app.providers import OfflineClient
+from app.quizgen import generate_quiz
+
+LATENCY_SECONDS = 0.2
+QUESTION_COUNTS = [1, 5, 10, 20]
+
+
+def time_generation(total_questions, concurrency, strategy):
+    client = OfflineClient(latency=LATENCY_SECONDS)
+    start = time.perf_counter()
+    generate_quiz(
+        "Benchmark Course",
+        "Undergraduate",
+        "",
+        "Benchmark Quiz",
+        "",
+        "medium",
+        total_questions,
+        100,
+        concurrency=concurrency,
+        client=client,
+        strategy=strategy,
+    )
+    return time.perf_counter() - start
+
+
+print(f"Offline provider latency: {LATENCY_SECONDS}s per call")
+print(f"{'questions':>10} {'sequential':>12} {'concurrent':>12} {'batched':>12}")
+
+for total_questions in QUESTION_COUNTS:
+    sequential = time_generation(total_questions, 1, "per_question")
+    concurrent = time_generation(total_questions, None, "per_question")
+    batched = time_generation(total_questions, None, "batched")
+    print(
+        f"{total_questions:>10} {sequential:>11.2f}s {concurrent:>11.2f}s {batched:>11.2f}s"
+    )
@@ -0,0 +1,120 @@
+# Run from the backend directory: python -m tests.benchmarkRegrade
+#
+# Regrades the submitted attempts of a test after its answer key and marks change,
+# on a scratch SQLite file: attempt by attempt through the ORM (check_answer and
+# calculate_score) and in batches with app.grading.regrade_attempts, as the regrade
+# job does. Reports attempts per second and SQL statements, and checks that both
+# paths give every attempt the same score. The ORM path is only timed on the
+# smaller class.
+
+from tests.support import clear_tables, add_teacher_and_course, add_test, measured
+import json, random, sys
+from sqlalchemy import insert
+from app import app
+from app.grading import regrade_attempts
+from app.models import db, Tests, Questions, StudentTestAttempt, StudentQuestionAttempt
+
+ATTEMPT_COUNTS = [2000, 20000]
+ORM_MAX_ATTEMPTS = 2000
+QUESTIONS = 20
+
+
+def seed(attempts):
+    clear_tables()
+    rng = random.Random(attempts)
+    teacher = add_teacher_and_course()
+    test, questions = add_test(teacher, "BENCH1", QUESTIONS)
+
+    # One student account is enough; attempts are what the regrade reads.
+    db.session.execute(
+        insert(StudentTestAttempt),
+        [
+            {
+                "student_id": teacher.id,
+                "test_id": test.test_id,
+                "status": "submitted",
+                "total_score": 0.0,
+            }
+            for _ in range(attempts)
+        ],
+    )
+
+    answers = []
+    for (attempt_id,) in db.session.execute(
+        db.select(StudentTestAttempt.attempt_id)
+    ):
+        for question, kind in questions:
+            selected = {
+                "mcq": lambda: rng.choice("ABCD"),
+                "msq": lambda: rng.sample("ABCD", rng.randint(1, 3)),
+                "nat": lambda: rng.choice([3, 4]),
+            }[kind]()
+            answers.append(
+                {
+                    "attempt_id": attempt_id,
+                    "question_id": question.question_id,
+                    "selected_answer": json.dumps(selected),
+                    "marks_obtained": 0.0,
+                }
+            )
+    db.session.execute(insert(StudentQuestionAttempt), answers)
+
+    # Grade against the original key, then fix the key: every MCQ answer is B
+    # and the NAT questions are worth 2.
+    regrade_bulk(test.test_id)
+    for question in Questions.query.filter_by(test_id=test.test_id):
+        if question.question_type == "mcq":
+            question.correct_answer = "B"
+        if question.question_type == "nat":
+            question.marks = 2.0
+    db.session.commit()
+    return test.test_id
+
+
+def regrade_orm(test_id):
+    for attempt in StudentTestAttempt.query.filter_by(test_id=test_id):
+        for question_attempt in attempt.question_attempts:
+            question_attempt.check_answer()
+        attempt.calculate_score()
+    db.session.commit()
+
+
+def regrade_bulk(test_id):
+    test = db.session.get(Tests, test_id)
+    last_attempt_id = 0
+    while last_attempt_id is not None:
+        last_attempt_id, _, _ = regrade_attempts(test, None, last_attempt_id)
+        db.session.commit()
+
+
+def scores(test_id):
+    return [
+        (a.attempt_id, round(a.total_score, 6), a.percentage, a.passed)
+        for a in StudentTestAttempt.query.filter_by(test_id=test_id).order_by(
+            StudentTestAttempt.attempt_id
+        )
+    ]
+
+
+def measure(regrade, attempts):
+    test_id = seed(attempts)
+    _, elapsed, statements = measured(regrade, test_id)
+    return attempts / elapsed, len(statements), scores(test_id)
+
+
+failed = False
+print(f"{'attempts':>8} {'path':>5} {'attempts/s':>11} {'statements':>11}")
+with app.app_context():
+    for attempts in ATTEMPT_COUNTS:
+        results = {}
+        for name, regrade in [("orm", regrade_orm), ("bulk", regrade_bulk)]:
+            if name == "orm" and attempts > ORM_MAX_ATTEMPTS:
+                continue
+            rate, statements, results[name] = measure(regrade, attempts)
+            print(f"{attempts:>8} {name:>5} {rate:>11.0f} {statements:>11}")
+
+        if "orm" in results and results["orm"] != results["bulk"]:
+            print(f"Scores differ for {attempts} attempts")
+            failed = True
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,152 @@
+# Run from the backend directory: python -m tests.benchmarkSubmit
+#
+# Replays the submit_attempt transaction for a whole class at once, with other
+# students polling their attempt status meanwhile, against a scratch SQLite file:
+# once as before (rollback journal, PRAGMA foreign_keys plus a commit before every
+# request) and once with the connection pragmas applied by app.setup.
+
+from tests.support import scratch_app, add_teacher_and_course, add_test, MCQ_KEYS
+import json, random, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import text
+from app.models import db, User, Questions, StudentTestAttempt, StudentQuestionAttempt
+
+STUDENTS = 200
+QUESTIONS = 20
+WRITERS = 8
+READERS = 8
+POLL_INTERVAL = 0.01
+
+
+def seed():
+    teacher = add_teacher_and_course()
+    test, _ = add_test(teacher, "BENCH1", QUESTIONS, keys=MCQ_KEYS, status="active")
+
+    for n in range(STUDENTS):
+        student = User(
+            name=f"Student {n}", email=f"s{n}@bench.in", role="student", password="x"
+        )
+        db.session.add(student)
+        db.session.flush()
+        db.session.add(
+            StudentTestAttempt(
+                student_id=student.id, test_id=test.test_id, status="in_progress"
+            )
+        )
+
+    db.session.commit()
+
+
+def submit(attempt_id, question_ids, tuned):
+    """The queries and writes of the submit_attempt endpoint."""
+    if not tuned:
+        db.session.execute(text("PRAGMA foreign_keys = ON"))
+        db.session.commit()
+
+    attempt = StudentTestAttempt.query.filter_by(
+        attempt_id=attempt_id, status="in_progress"
+    ).first()
+
+    for question_id in question_ids:
+        question = Questions.query.filter_by(
+            question_id=question_id, test_id=attempt.test_id
+        ).first()
+        question_attempt = StudentQuestionAttempt.query.filter_by(
+            attempt_id=attempt_id, question_id=question_id
+        ).first()
+
+        if not question_attempt:
+            question_attempt = StudentQuestionAttempt(
+                attempt_id=attempt_id,
+                question_id=question_id,
+                selected_answer=json.dumps(random.choice("ABCD")),
+            )
+            db.session.add(question_attempt)
+
+        question_attempt.question = question
+        question_attempt.check_answer()
+
+    attempt.calculate_score()
+    attempt.status = "submitted"
+    attempt.submitted_at = datetime.utcnow()
+    db.session.commit()
+
+
+def poll(student_id, test_id, tuned):
+    """The read of a student polling quiz_status."""
+    if not tuned:
+        db.session.execute(text("PRAGMA foreign_keys = ON"))
+        db.session.commit()
+
+    StudentTestAttempt.query.filter_by(test_id=test_id, student_id=student_id).first()
+    db.session.commit()
+
+
+def run(tuned):
+    bench_app = scratch_app(tuned)
+
+    with bench_app.app_context():
+        seed()
+        attempts = [
+            (a.attempt_id, a.student_id, a.test_id) for a in StudentTestAttempt.query
+        ]
+        question_ids = [q.question_id for q in Questions.query]
+
+    errors = []
+    reads = []
+    done = threading.Event()
+
+    def submit_one(attempt):
+        with bench_app.app_context():
+            try:
+                submit(attempt[0], question_ids, tuned)
+            except Exception as e:
+                db.session.rollback()
+                errors.append(e)
+
+    def read_loop():
+        count = 0
+        with bench_app.app_context():
+            while not done.is_set():
+                _, student_id, test_id = random.choice(attempts)
+                try:
+                    poll(student_id, test_id, tuned)
+                    count += 1
+                    time.sleep(POLL_INTERVAL)
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(e)
+        reads.append(count)
+
+    readers = [threading.Thread(target=read_loop) for _ in range(READERS)]
+    for reader in readers:
+        reader.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WRITERS) as executor:
+        list(executor.map(submit_one, attempts))
+    elapsed = time.perf_counter() - start
+
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    with bench_app.app_context():
+        journal_mode = db.session.execute(text("PRAGMA journal_mode")).scalar()
+        db.engine.dispose()
+
+    return journal_mode, elapsed, sum(reads), len(errors)
+
+
+print(
+    f"{STUDENTS} submissions of {QUESTIONS} answers, {WRITERS} concurrent writers, "
+    f"{READERS} status pollers"
+)
+print(f"{'journal':>8} {'seconds':>8} {'submits/s':>10} {'reads/s':>8} {'errors':>7}")
+for tuned in [False, True]:
+    journal_mode, elapsed, reads, errors = run(tuned)
+    print(
+        f"{journal_mode:>8} {elapsed:>8.2f} {STUDENTS / elapsed:>10.1f} "
+        f"{reads / elapsed:>8.1f} {errors:>7}"
+    )
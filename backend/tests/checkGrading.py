@@ -0,0 +1,131 @@
+# Run from the backend directory: python -m tests.checkGrading [seed]
+#
+# Grades random answer keys and answer sheets with app.grading and with
+# StudentQuestionAttempt.check_answer, the reference, and exits with an error on the
+# first answer they disagree on. Keys and answers are drawn to hit the edge cases:
+# repeated and unknown option ids, answers of the wrong type, numbers as strings,
+# "nan" and overflowing NAT answers, MSQ keys with repeats, more than 64 options.
+
+import tests.support
+import contextlib, io, json, random, sys
+from types import SimpleNamespace
+from app.grading import AnswerKey, grade_sheets
+from app.models import StudentQuestionAttempt
+
+KEYS = 300
+SHEETS_PER_KEY = 20
+QUESTIONS_PER_KEY = 12
+
+
+def random_option_ids(rng):
+    count = rng.choice([1, 2, 4, 5, 70])
+    ids = [f"opt{n}" for n in range(count)]
+    if rng.random() < 0.1:
+        ids.append(rng.choice([ids[0], 7, None]))
+    return ids
+
+
+def random_value(rng, option_ids):
+    """Anything a client might send, or a teacher might have stored, as an answer."""
+    choices = [
+        lambda: rng.choice(option_ids),
+        lambda: rng.sample(option_ids, rng.randint(0, min(len(option_ids), 4))),
+        lambda: [rng.choice(option_ids) for _ in range(rng.randint(1, 3))],
+        lambda: rng.choice(["opt1", "OPT1", "zzz", "", "nan", "inf", "1e400", " 3 "]),
+        lambda: rng.randint(-3, 3),
+        lambda: rng.choice([0.5, 2.004, 1.99, -0.0, 1e300]),
+        lambda: str(rng.randint(-3, 3)),
+        lambda: f"{rng.randint(-3, 3) + rng.choice([0, 0.001, 0.02]):.3f}",
+        lambda: rng.choice([None, True, False, {}, {"id": "opt0"}, [1, "opt0"]]),
+        lambda: 10**400,
+    ]
+    return rng.choice(choices)()
+
+
+def random_question(rng, question_id):
+    question_type = rng.choice(["mcq", "MCQ", "msq", "nat", "Nat", "essay"])
+    option_ids = random_option_ids(rng)
+    kind = question_type.lower()
+
+    if rng.random() < 0.8 and kind == "mcq":
+        answer = rng.choice(option_ids)
+    elif rng.random() < 0.8 and kind == "msq":
+        answer = rng.sample(option_ids, rng.randint(0, min(len(option_ids), 4)))
+    elif rng.random() < 0.8 and kind == "nat":
+        answer = rng.randint(-3, 3)
+    else:
+        answer = random_value(rng, option_ids)
+
+    correct_answer = json.dumps(answer) if rng.random() > 0.02 else "{not json"
+    options = json.dumps([{"id": option_id, "text": "x"} for option_id in option_ids])
+    marks = rng.choice([1, 2, 2.5])
+    return (question_id, question_type, options, correct_answer, marks), option_ids
+
+
+def reference(row, selected):
+    question_id, question_type, options, correct_answer, marks = row
+    question_attempt = SimpleNamespace(
+        question=SimpleNamespace(
+            question_type=question_type, correct_answer=correct_answer, marks=marks
+        ),
+        selected_answer=json.dumps(selected),
+    )
+    # check_answer prints the exceptions it turns into wrong answers.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return StudentQuestionAttempt.check_answer(question_attempt)
+
+
+def check(seed):
+    rng = random.Random(seed)
+    compared = 0
+
+    for _ in range(KEYS):
+        questions = [random_question(rng, 100 + n) for n in range(QUESTIONS_PER_KEY)]
+        rows = [row for row, _ in questions]
+        key = AnswerKey(rows)
+
+        sheets = []
+        for _ in range(SHEETS_PER_KEY):
+            sheet = {}
+            for row, option_ids in questions:
+                if rng.random() < 0.85:
+                    # The reference sees the answer after a JSON round trip, as
+                    # submit_attempt's request body gives it.
+                    sheet[row[0]] = json.loads(
+                        json.dumps(random_value(rng, option_ids))
+                    )
+            sheet[999] = "opt0"  # Not in the test: ignored
+            sheets.append(sheet)
+
+        graded = grade_sheets(key, sheets)
+
+        for n, sheet in enumerate(sheets):
+            for position, (row, _) in enumerate(questions):
+                if row[0] not in sheet:
+                    assert not graded.answered[n, position]
+                    continue
+
+                expected = reference(row, sheet[row[0]])
+                got = (
+                    bool(graded.is_correct[n, position]),
+                    float(graded.marks[n, position]),
+                )
+                if got != expected:
+                    answer = sheet[row[0]]
+                    print(f"Mismatch (seed {seed}) for {row} answered {answer!r}")
+                    print(f"  engine {got}, check_answer {expected}")
+                    sys.exit(1)
+                compared += 1
+
+            expected_score = sum(
+                reference(row, sheet[row[0]])[1]
+                for row, _ in questions
+                if row[0] in sheet
+            )
+            assert abs(graded.scores()[n] - expected_score) < 1e-9
+
+    return compared
+
+
+seed = int(sys.argv[1]) if len(sys.argv) > 1 else random.randrange(10**6)
+print(f"{check(seed)} answers graded the same as check_answer (seed {seed})")
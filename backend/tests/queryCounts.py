@@ -0,0 +1,119 @@
+# Run from the backend directory: python -m tests.queryCounts
+#
+# Calls the student endpoints against scratch SQLite databases holding a course with
+# a growing number of quizzes, each attempted by the student (the first one once per
+# quiz), and counts the SQL statements each request runs. Exits with an error if an endpoint runs more than its
+# budget, or more statements for a longer history.
+
+from tests.support import (
+    clear_tables,
+    add_user,
+    add_teacher_and_course,
+    add_test,
+    measured,
+    MCQ_KEYS,
+)
+import sys
+from datetime import datetime, timedelta
+from app import app
+from app.identity import access_token_for, user_cache
+from app.models import (
+    db,
+    Student_Courses_Map,
+    Tests,
+    StudentTestAttempt,
+    StudentQuestionAttempt,
+)
+
+QUIZ_COUNTS = [1, 10, 40]
+QUESTIONS = 5
+
+# Endpoint -> the most statements one request may run, whatever the history length.
+# Each includes reading User.updated_at, which a worker does for a user at most every
+# USER_CACHE_TTL_SECONDS; count_statements always makes the request pay for it.
+BUDGETS = {
+    "/student/list_quizzes/QC101": 4,
+    "/student/results": 2,
+    # 5 once the test's answer key is cached; the first request compiles it.
+    "/student/results/{test_id}": 6,
+    "/student/course_analytics/QC101": 3,
+}
+
+
+def seed(quizzes):
+    clear_tables()
+    teacher = add_teacher_and_course("QC101", "Query Count Course", "teacher@qc.in")
+    student = add_user("Student", "student@qc.in", "student")
+    db.session.add(Student_Courses_Map(student_id=student.id, course_id="QC101"))
+
+    for n in range(quizzes):
+        test, questions = add_test(
+            teacher,
+            "QC101",
+            QUESTIONS,
+            keys=MCQ_KEYS,
+            tags=lambda q: [f"topic{(n * q) % 7}", "qc"],
+            title=f"Quiz {n}",
+            start_time=datetime.utcnow() - timedelta(days=n + 1),
+            duration_minutes=30,
+        )
+
+        for a in range(quizzes if n == 0 else 1):
+            attempt = StudentTestAttempt(
+                student_id=student.id,
+                test_id=test.test_id,
+                status="submitted",
+                submitted_at=test.start_time + timedelta(minutes=a + 10),
+            )
+            db.session.add(attempt)
+            db.session.flush()
+
+            for q, (question, _) in enumerate(questions):
+                db.session.add(
+                    StudentQuestionAttempt(
+                        attempt_id=attempt.attempt_id,
+                        question_id=question.question_id,
+                        selected_answer='"A"' if q % 2 == 0 else '"B"',
+                        is_correct=q % 2 == 0,
+                        marks_obtained=1 if q % 2 == 0 else 0,
+                    )
+                )
+            attempt.total_score = (QUESTIONS + 1) // 2
+
+    db.session.commit()
+    first_test_id = Tests.query.filter_by(title="Quiz 0").first().test_id
+    return access_token_for(student), first_test_id
+
+
+def count_statements(client, url, token):
+    user_cache.changed_at.clear()
+    response, _, statements = measured(
+        client.get, url, headers={"Authorization": f"Bearer {token}"}
+    )
+
+    if response.status_code != 200:
+        raise RuntimeError(f"{url}: {response.status_code} {response.get_json()}")
+
+    # SQLite pragmas run once per new pooled connection, not per request.
+    return len([s for s in statements if not s.startswith("PRAGMA")])
+
+
+counts = {url: [] for url in BUDGETS}
+with app.app_context():
+    client = app.test_client()
+    for quizzes in QUIZ_COUNTS:
+        token, test_id = seed(quizzes)
+        for url in BUDGETS:
+            counts[url].append(
+                count_statements(client, url.format(test_id=test_id), token)
+            )
+
+print(f"{'endpoint':<40} {'budget':>6} " + " ".join(f"{n:>4}q" for n in QUIZ_COUNTS))
+failed = []
+for url, budget in BUDGETS.items():
+    print(f"{url:<40} {budget:>6} " + " ".join(f"{c:>5}" for c in counts[url]))
+    if max(counts[url]) > budget or len(set(counts[url])) > 1:
+        failed.append(url)
+
+if failed:
+    sys.exit(f"Over budget or growing with the number of quizzes: {', '.join(failed)}")
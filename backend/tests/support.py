@@ -0,0 +1,159 @@
+# What the scripts in this directory share. Import it before anything from app:
+# importing app starts the application, and this points it at a scratch SQLite file
+# and response cache instead of users.db and the instance folder.
+#
+# A DATABASE_URL already set (the PostgreSQL container of the README, say) is used
+# instead. The scripts empty its tables, so they only do so when
+# TESTS_CLEAR_DATABASE=1 says it is a throwaway database.
+
+import os, sys, tempfile
+
+SCRATCH_DIR = tempfile.mkdtemp()
+SCRATCH_DATABASE_URL = "sqlite:///" + os.path.join(SCRATCH_DIR, "app.db")
+os.environ.setdefault("DATABASE_URL", SCRATCH_DATABASE_URL)
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(SCRATCH_DIR, "llm_cache.db"))
+
+import time
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import event
+from app.models import db, User, Courses, Tests, Questions
+from app.setup import configure_engine
+
+# (question_type, correct_answer) that add_test cycles through
+MIXED_KEYS = [("mcq", "A"), ("msq", ["A", "C"]), ("nat", 3)]
+MCQ_KEYS = [("mcq", "A")]
+
+
+def scratch_app(tuned=True):
+    """
+    A bare Flask app on a new scratch SQLite file, with the tables created. With
+    ``tuned`` the connections get the pragmas of app.setup.
+    """
+    scratch = Flask(__name__)
+    scratch.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+    db.init_app(scratch)
+
+    with scratch.app_context():
+        if tuned:
+            configure_engine(db.engine)
+        db.create_all()
+
+    return scratch
+
+
+def clear_tables():
+    if (
+        os.environ["DATABASE_URL"] != SCRATCH_DATABASE_URL
+        and os.getenv("TESTS_CLEAR_DATABASE") != "1"
+    ):
+        sys.exit(
+            "DATABASE_URL is set, and this script empties its tables. "
+            "Set TESTS_CLEAR_DATABASE=1 if it is a throwaway database."
+        )
+
+    for table in reversed(db.metadata.sorted_tables):
+        db.session.execute(table.delete())
+
+
+def add_user(name, email, role):
+    # Registered a while before any token is issued, so the token's claims are trusted.
+    user = User(
+        name=name,
+        email=email,
+        role=role,
+        password="x",
+        updated_at=datetime.utcnow() - timedelta(minutes=1),
+    )
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def add_teacher_and_course(
+    course_id="BENCH1", course_name="Benchmark Course", email="teacher@bench.in"
+):
+    """A teacher and a course for them; returns the teacher."""
+    teacher = add_user("Teacher", email, "teacher")
+    db.session.add(
+        Courses(
+            course_id=course_id,
+            course_name=course_name,
+            course_level="Undergraduate",
+            course_objectives="",
+        )
+    )
+    db.session.flush()
+    return teacher
+
+
+def add_test(
+    teacher,
+    course_id,
+    questions,
+    keys=MIXED_KEYS,
+    marks=1,
+    tags=lambda position: ["bench"],
+    **fields,
+):
+    """
+    A test of ``questions`` questions cycling through ``keys``, each worth ``marks``,
+    with four options A to D. ``fields`` override the test's defaults. Returns the
+    test and its [(question, question_type)].
+    """
+    test = Tests(
+        **{
+            "course_id": course_id,
+            "title": "Benchmark Quiz",
+            "difficulty_level": "Medium",
+            "start_time": datetime.utcnow(),
+            "duration_minutes": 60,
+            "total_questions": questions,
+            "total_marks": questions * marks,
+            "passing_marks": questions * marks // 2,
+            "created_by": teacher.id,
+            "status": "completed",
+            **fields,
+        }
+    )
+    db.session.add(test)
+    db.session.flush()
+
+    added = []
+    for n in range(questions):
+        question_type, correct_answer = keys[n % len(keys)]
+        question = Questions(
+            test_id=test.test_id,
+            question_text=f"Question {n} of {test.title}",
+            question_type=question_type,
+            options=[{"id": letter, "text": letter} for letter in "ABCD"],
+            correct_answer=correct_answer,
+            tags=tags(n),
+            marks=marks,
+            difficulty_level="medium",
+        )
+        db.session.add(question)
+        added.append((question, question_type))
+    db.session.flush()
+
+    return test, added
+
+
+def measured(fn, *args, **kwargs):
+    """Call ``fn``; returns its result, the seconds taken and the statements it ran."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+    return result, elapsed, statements